@@ -1,17 +1,7 @@
 import streamlit as st
-import io
-import re
 import json
-import uuid
 import os
-import subprocess
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
-from pypdf import PdfReader, PdfWriter
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import mm
-from tempfile import NamedTemporaryFile
+from binder_engine import JobQueue, binder_item, get_job_queue, get_prefetcher, get_setting, list_files_from_drive
 
 # ==========================================
 # 1. עיצוב CSS
@@ -79,6 +69,8 @@ st.markdown("""
     .bg-pdf { background: #ffebee; color: #c62828; }
     .bg-word { background: #e3f2fd; color: #1565c0; }
     .bg-gdoc { background: #e8f5e9; color: #2e7d32; }
+    .ready-badge { font-size: 11px; color: #6c757d; margin-right: 6px; white-space: nowrap; }
+    .ready-badge.ready { color: #198754; }
     
     /* מספר נספח */
     .annex-num { font-weight: bold; color: #0d6efd; font-size: 16px; text-align: center; }
@@ -93,134 +85,65 @@ st.markdown("""
 if 'binder_files' not in st.session_state or not isinstance(st.session_state.binder_files, list):
     st.session_state.binder_files = []
 if 'folder_id' not in st.session_state: st.session_state.folder_id = None
+if 'selected' not in st.session_state: st.session_state.selected = set()
 
 # ==========================================
-# 3. מנוע גוגל דרייב
+# 3. מצב הכנה ובנייה
 # ==========================================
-def get_drive_service():
-    try:
-        key_content = st.secrets["gcp_key"]
-        creds_dict = json.loads(key_content, strict=False)
-        creds = service_account.Credentials.from_service_account_info(creds_dict, scopes=['https://www.googleapis.com/auth/drive'])
-        return build('drive', 'v3', credentials=creds)
-    except: return None
-
-def list_files_from_drive(folder_link):
-    match = re.search(r'folders/([a-zA-Z0-9-_]+)', folder_link)
-    fid = match.group(1) if match else (folder_link if len(folder_link)>20 else None)
-    if not fid: return None, "קישור לא תקין"
-    service = get_drive_service()
-    if not service: return None, "שגיאת חיבור"
-    try:
-        query = (f"'{fid}' in parents and trashed=false and "
-                 f"(mimeType='application/pdf' or "
-                 f"mimeType contains 'application/vnd.google-apps' or "
-                 f"mimeType='application/vnd.openxmlformats-officedocument.wordprocessingml.document')")
-        
-        results = service.files().list(
-            q=query,
-            fields="files(id, name, mimeType, createdTime)", 
-            orderBy="createdTime", 
-            supportsAllDrives=True, 
-            includeItemsFromAllDrives=True
-        ).execute()
-        return fid, results.get('files', [])
-    except Exception as e: return None, str(e)
-
-def convert_word_to_pdf(input_bytes):
-    try:
-        with NamedTemporaryFile(suffix='.docx', delete=False) as f_in:
-            f_in.write(input_bytes); input_path = f_in.name
-        out_dir = os.path.dirname(input_path)
-        subprocess.run(['libreoffice', '--headless', '--convert-to', 'pdf', input_path, '--outdir', out_dir], check=True)
-        pdf_path = input_path.replace('.docx', '.pdf')
-        with open(pdf_path, 'rb') as f_out: pdf_bytes = f_out.read()
-        try: os.remove(input_path); os.remove(pdf_path)
-        except: pass
-        return io.BytesIO(pdf_bytes)
-    except: return None
-
-def download_file_content(file_id, mime_type):
-    service = get_drive_service()
-    fh = io.BytesIO()
-    if 'vnd.google-apps' in mime_type:
-        request = service.files().export_media(fileId=file_id, mimeType='application/pdf')
-    else:
-        request = service.files().get_media(fileId=file_id)
-    
-    downloader = MediaIoBaseDownload(fh, request); done = False
-    while done is False: _, done = downloader.next_chunk()
-    fh.seek(0)
-    
-    if 'word' in mime_type or 'document' in mime_type:
-        return convert_word_to_pdf(fh.getvalue())
-    return fh
-
-def upload_final_pdf(folder_id, pdf_bytes, name):
-    service = get_drive_service()
-    meta = {'name': name, 'parents': [folder_id]}
-    media = MediaIoBaseUpload(io.BytesIO(pdf_bytes), mimetype='application/pdf')
-    service.files().create(body=meta, media_body=media, supportsAllDrives=True).execute()
-
-def rename_drive_file(file_id, new_name):
-    service = get_drive_service()
-    service.files().update(fileId=file_id, body={'name': new_name}, supportsAllDrives=True).execute()
-
-# ==========================================
-# 4. מנוע PDF
-# ==========================================
-def generate_cover_html(annex_num, title, doc_start_page):
-    return f"""<!DOCTYPE html><html dir="rtl"><head><meta charset="UTF-8"><style>
-    body{{font-family:'DejaVu Sans';text-align:center;padding-top:250px;}}
-    .annex-title{{font-size:40px;font-weight:bold;margin-bottom:20px;}}
-    .doc-title{{font-size:50px;font-weight:bold;margin-bottom:60px;}}
-    .page-num{{font-size:30px;}}</style></head><body>
-    <div class="annex-title">נספח {annex_num}</div>
-    <div class="doc-title">{title}</div>
-    <div class="page-num">עמוד {doc_start_page}</div></body></html>"""
-
-def generate_toc_html(rows):
-    html_rows = ""
-    for r in rows:
-        num_display = f"נספח {r['num']}"
-        html_rows += f"<tr><td style='text-align:center;font-weight:bold;'>{num_display}</td><td style='text-align:right;padding-right:10px;'>{r['title']}</td><td style='text-align:center;'>{r['page']}</td></tr>"
-    return f"""<!DOCTYPE html><html dir="rtl"><head><meta charset="UTF-8"><style>
-    body{{font-family:'DejaVu Sans';padding:40px;}}h1{{text-align:center;font-size:45px;font-weight:bold;margin-bottom:30px;}}
-    table{{width:100%;border-collapse:collapse;border:2px solid black;}}th,td{{border:1px solid black;padding:10px;font-size:18px;}}
-    th{{background:#fff;font-weight:bold;font-size:20px;text-align:center;border-bottom:2px solid black;}}</style></head><body>
-    <h1>תוכן עניינים לנספחים</h1><table><thead><tr><th style="width:20%">סוג/מספר</th><th style="width:65%">שם הנספח</th><th style="width:15%">עמוד</th></tr></thead><tbody>{html_rows}</tbody></table></body></html>"""
-
-def html_to_pdf(html):
-    try:
-        with NamedTemporaryFile(suffix='.html', delete=False, mode='w', encoding='utf-8') as f: f.write(html); tmp=f.name
-        out = tmp.replace('.html','.pdf')
-        subprocess.run(['wkhtmltopdf','--quiet','--page-size','A4','--margin-top','20mm',tmp,out], check=True)
-        with open(out,'rb') as f: return f.read()
-    except: return None
-
-def add_footer_numbers(pdf_bytes):
-    reader = PdfReader(io.BytesIO(pdf_bytes)); writer = PdfWriter()
-    for i, page in enumerate(reader.pages):
-        w, h = float(page.mediabox.width), float(page.mediabox.height)
-        rot = int(page.get('/Rotate', 0) or 0) % 360
-        packet = io.BytesIO(); can = canvas.Canvas(packet, pagesize=(w, h)); can.setFont("Helvetica", 12)
-        if rot == 0: can.drawCentredString(w/2, 10*mm, str(i+1))
-        elif rot == 90: can.translate(w-10*mm, h/2); can.rotate(90); can.drawCentredString(0,0,str(i+1))
-        elif rot == 270: can.translate(10*mm, h/2); can.rotate(270); can.drawCentredString(0,0,str(i+1))
-        can.save(); packet.seek(0); page.merge_page(PdfReader(packet).pages[0]); writer.add_page(page)
-    out = io.BytesIO(); writer.write(out); return out.getvalue()
-
-def compress_if_needed(pdf_bytes):
-    if len(pdf_bytes) < 25*1024*1024: return pdf_bytes
-    try:
-        with NamedTemporaryFile(suffix='.pdf', delete=False) as f: f.write(pdf_bytes); inp=f.name
-        out = inp.replace('.pdf','_c.pdf')
-        subprocess.run(["gs","-sDEVICE=pdfwrite","-dPDFSETTINGS=/ebook","-dNOPAUSE","-dQUIET","-dBATCH",f"-sOutputFile={out}",inp], check=True)
-        with open(out,'rb') as f: return f.read()
-    except: return pdf_bytes
+def show_prefetch(files):
+    # סיכום ההכנה ברקע; נטען מחדש כל 2 שניות רק כל עוד יש קבצים בהכנה
+    pending = sum(1 for f in files if (get_prefetcher().status(f) or {}).get('state') == 'pending')
+    st.fragment(run_every=2 if pending else None)(render_prefetch)(files, pending)
+
+def render_prefetch(files, was_pending):
+    states = [get_prefetcher().status(f) or {} for f in files]
+    pending = sum(1 for s in states if s.get('state') == 'pending')
+    ready = [s for s in states if s.get('state') == 'ready']
+    # בסיום מרעננים את כל הדף כדי שהתגיות בשורות יתעדכנו
+    if was_pending and not pending: st.rerun()
+    pages = sum(s['pages'] for s in ready)
+    if pending: st.caption(f"⏳ מכין קבצים ברקע: {len(ready)}/{len(files)} מוכנים · {pages} עמודים")
+    elif ready: st.caption(f"✅ {len(ready)}/{len(files)} קבצים מוכנים · {pages} עמודים")
+
+def show_job(job_id):
+    # מצב העבודה מתעדכן בתוך fragment שנטען מחדש כל 2 שניות, רק כל עוד העבודה פעילה
+    job = get_job_queue().get(job_id)
+    if not job: return
+    active = job['status'] in JobQueue.ACTIVE
+    st.fragment(run_every=2 if active else None)(render_job)(job_id, active)
+
+def render_job(job_id, was_active):
+    jobs = get_job_queue(); job = jobs.get(job_id)
+    if was_active and job['status'] not in JobQueue.ACTIVE: st.rerun()
+    name = f"{json.loads(job['params'])['name']}.pdf"
+    if job['status'] in JobQueue.ACTIVE:
+        st.info(job['stage'] or "⏳ ממתין בתור...")
+        st.progress(min(1.0, job['progress'] or 0))
+        if st.button("⛔ בטל", key=f"cancel_{job_id}"): jobs.cancel(job_id)
+    elif job['status'] == 'done' and job['output']:
+        st.warning(job['stage'])
+        if os.path.exists(job['output']):
+            with open(job['output'], 'rb') as f: st.download_button("📥 הורד", f.read(), name)
+    elif job['status'] == 'done':
+        st.success(job['stage'])
+        if not st.session_state.get(f"celebrated_{job_id}"): st.session_state[f"celebrated_{job_id}"] = True; st.balloons()
+    elif job['status'] == 'cancelled': st.warning(job['stage'] or "⛔ בוטל")
+    else: st.error(job['stage'])
+    for w in job['warnings']: st.warning(w)
+    if job['report']: show_report(job['report'])
+
+def show_report(report):
+    # דוח זמנים מקופל: שלבים לפי זמן, והקבצים האיטיים ביותר
+    with st.expander(f"⏱️ דוח זמנים · {report['total']:.1f} שנ' · שיא זיכרון {report['peak_rss_mb']:.0f}MB"):
+        st.dataframe(sorted(report['stages'], key=lambda r: -r['wall']), hide_index=True)
+        if report['slowest']:
+            st.caption("הקבצים האיטיים ביותר")
+            st.dataframe([{k: s.get(k) for k in ('stage', 'file', 'wall', 'bytes', 'pages', 'error')} for s in report['slowest']],
+                         hide_index=True)
+        for s in report['errors']: st.caption(f"⚠️ {s['stage']} · {s.get('file', '')}: {s['error']}")
 
 # ==========================================
-# 5. ממשק משתמש
+# 4. ממשק משתמש
 # ==========================================
 
 st.markdown("<h1>מערכת איגוד מסמכים</h1>", unsafe_allow_html=True)
@@ -229,34 +152,112 @@ with st.container():
     c1, c2, c3, c4 = st.columns([3, 1.5, 1, 1])
     link = c1.text_input("לינק", placeholder="הדבק לינק...", label_visibility="collapsed")
     final_name = c2.text_input("שם קובץ", "קלסר_נספחים", label_visibility="collapsed")
+    target_mb = c2.number_input("יעד גודל (MB)", min_value=0, value=get_setting('target_mb', 25),
+                                help="אם הקלסר גדול מזה, התמונות הסרוקות נדחסות ברמה הקלה ביותר שמספיקה. 0 = ללא דחיסה")
     rename_source = c3.checkbox("סדר שמות")
+    spool_to_disk = c3.checkbox("קבצי מקור בדיסק", value=get_setting('spool_to_disk', False),
+                                help="קבצי המקור ממופים מהדיסק במקום להיטען לזיכרון, והקלסר נכתב לקובץ. ההרכבה עדיין מחזיקה את עמודי הקלסר בזיכרון, כך שהזיכרון עדיין גדל עם גודל הקלסר")
+    include_subfolders = c3.checkbox("כולל תתי-תיקיות")
+    update_existing = c3.checkbox("עדכן קלסר קיים", help="אם כבר יש בתיקייה קלסר באותו שם, תועלה אליו גרסה חדשה במקום קובץ נוסף")
+    linearize = c3.checkbox("תצוגה מהירה", value=get_setting('linearize', True), help="הקלסר נשמר כך שהעמוד הראשון נפתח לפני שכל הקובץ ירד (דורש qpdf)")
     
     if c4.button("📥 משוך"):
         if link:
-            fid, result = list_files_from_drive(link)
+            fid, result = list_files_from_drive(link, recursive=include_subfolders)
             if fid and isinstance(result, list):
                 st.session_state.folder_id = fid
-                st.session_state.binder_files = [] 
-                for f in result:
-                    mime = f.get('mimeType', '')
-                    if 'word' in mime or 'document' in mime: f_type = "WORD"
-                    elif 'google-apps' in mime: f_type = "GDOC"
-                    else: f_type = "PDF"
-                    st.session_state.binder_files.append({
-                        "type": "file", "id": f['id'], "name": f['name'], 
-                        "title": "", "merge": False, "is_main": False,
-                        "key": f['id'], "mime": mime, "ftype": f_type,
-                        "unique_id": str(uuid.uuid4())
-                    })
+                st.session_state.binder_files = [binder_item(f) for f in result]
+                # ההורדה וההמרה מתחילות כבר עכשיו, בזמן שהמשתמש מסדר את הטבלה
+                get_prefetcher().submit(st.session_state.binder_files)
                 st.rerun()
             else: st.error(f"שגיאה: {result}")
 
-if st.session_state.binder_files:
-    st.markdown("<br>", unsafe_allow_html=True)
-    
+# --- טבלת הקלסר ---
+# הטבלה היא fragment: כל פעולה בשורה משנה את הנתונים ב-callback ומריצה מחדש רק את הטבלה, לא את כל הדף.
+# מוצג רק עמוד אחד של שורות, כך שזמן התגובה לא תלוי בגודל התיקייה. ערכי הווידג'טים נזרעים מהנתונים
+# לפני שהם נוצרים, ולכן אחרי מעבר עמוד או פעולה מרוכזת הם תמיד משקפים את binder_files
+ROW_WIDGETS = ('sel', 'main', 'm', 't')
+
+def seed_widget(key, value):
+    if key not in st.session_state: st.session_state[key] = value
+
+def forget_widgets(uids):
+    for uid in uids:
+        for prefix in ROW_WIDGETS: st.session_state.pop(f"{prefix}_{uid}", None)
+
+def set_flag(item, flag, key):
+    item[flag] = st.session_state[key]
+    if flag == 'is_main' and item[flag]: item['merge'] = False
+
+def set_title(item, key): item['title'] = st.session_state[key]
+
+def toggle_selected(uid, key):
+    if st.session_state[key]: st.session_state.selected.add(uid)
+    else: st.session_state.selected.discard(uid)
+
+def swap_rows(i, j):
+    files = st.session_state.binder_files; files[i], files[j] = files[j], files[i]
+
+def move_selected(key):
+    # הנבחרים עוברים כגוש (בסדר היחסי שלהם) כך שהראשון שבהם יהיה במיקום המבוקש
+    files = st.session_state.binder_files; sel = st.session_state.selected
+    picked = [f for f in files if f['unique_id'] in sel]; rest = [f for f in files if f['unique_id'] not in sel]
+    pos = min(max(int(st.session_state[key]), 1) - 1, len(rest))
+    st.session_state.binder_files = rest[:pos] + picked + rest[pos:]
+    st.session_state.table_page = pos // table_page_size()
+
+def bulk_set(flag, value):
+    for i, f in enumerate(st.session_state.binder_files):
+        if f['unique_id'] not in st.session_state.selected: continue
+        if flag == 'merge' and value and (i == 0 or f.get('is_main')): continue
+        f[flag] = value
+        if flag == 'is_main' and value: f['merge'] = False
+    forget_widgets(st.session_state.selected)
+
+def delete_selected():
+    sel = st.session_state.selected
+    st.session_state.binder_files = [f for f in st.session_state.binder_files if f['unique_id'] not in sel]
+    forget_widgets(sel); sel.clear()
+
+def select_rows(uids, value):
+    forget_widgets(uids)
+    if value: st.session_state.selected.update(uids)
+    else: st.session_state.selected.difference_update(uids)
+
+def table_page_size(): return max(10, get_setting('table_page_size', 50))
+
+@st.fragment
+def render_table():
+    files = st.session_state.binder_files; sel = st.session_state.selected
+    if not files: return
+    sel.intersection_update(f['unique_id'] for f in files)
+    size = table_page_size(); pages = (len(files) - 1) // size + 1
+    st.session_state.table_page = min(st.session_state.get('table_page', 0), pages - 1)
+
+    # מספור נספחים ותקינות מיזוג על כל הרשימה (בלי ווידג'טים, זול גם באלפי שורות)
+    labels = []; running_annex_num = 0
+    for i, item in enumerate(files):
+        if item.get('is_main'): item['merge'] = False; labels.append(("row-main", "⭐"))
+        elif item.get('merge') and i > 0: labels.append(("row-merged", "🔗"))
+        else: item['merge'] = False; running_annex_num += 1; labels.append(("row-annex", str(running_annex_num)))
+
+    if sel:
+        with st.container(border=True):
+            b = st.columns([1.2, 1, 0.8, 1, 1, 1, 1, 1, 1])
+            b[0].markdown(f"**{len(sel)} נבחרו**")
+            st.session_state.move_to = min(st.session_state.get('move_to', 1), len(files))
+            b[1].number_input("מיקום", 1, len(files), key="move_to", label_visibility="collapsed")
+            b[2].button("↕️ העבר", on_click=move_selected, args=("move_to",), help="העבר את הנבחרים למיקום הזה")
+            b[3].button("⭐ ראשי", on_click=bulk_set, args=('is_main', True))
+            b[4].button("☆ לא ראשי", on_click=bulk_set, args=('is_main', False))
+            b[5].button("🔗 מזג", on_click=bulk_set, args=('merge', True))
+            b[6].button("✂️ פצל", on_click=bulk_set, args=('merge', False))
+            b[7].button("🗑️ מחק", on_click=delete_selected)
+            b[8].button("✕ נקה", on_click=select_rows, args=(set(sel), False))
+
     st.markdown("""
     <div class="table-header">
-        <div style="width:5%; text-align:center;">מחק</div>
+        <div style="width:5%; text-align:center;">בחר</div>
         <div style="width:8%; text-align:center;">סדר</div>
         <div style="width:5%; text-align:center;">ראשי</div>
         <div style="width:5%; text-align:center;">מזג</div>
@@ -265,237 +266,75 @@ if st.session_state.binder_files:
         <div style="width:35%;">שם הקובץ המקורי</div>
     </div>
     """, unsafe_allow_html=True)
-    
-    mv_up=None; mv_dn=None; to_del=[]
-    running_annex_num = 0
-    
-    for i, item in enumerate(st.session_state.binder_files):
-        uid = item.get('unique_id', str(i))
-        display_num = ""
-        row_style = "file-row"
-        
-        is_main = item.get('is_main', False)
-        is_merged = item.get('merge', False)
-        
-        if is_main:
-            row_style = "row-main"
-            display_num = "⭐"
-            item['merge'] = False 
-        elif is_merged:
-            row_style = "row-merged"
-            display_num = "🔗"
-        else: 
-            running_annex_num += 1
-            display_num = str(running_annex_num)
-            row_style = "row-annex"
-            
-        disable_merge = (i == 0) or is_main
 
+    start = st.session_state.table_page * size
+    for i in range(start, min(start + size, len(files))):
+        item = files[i]; uid = item['unique_id']; row_style, display_num = labels[i]
         with st.container():
             st.markdown(f'<div class="data-row {row_style}">', unsafe_allow_html=True)
             cols = st.columns([0.5, 0.8, 0.5, 0.5, 0.5, 4.2, 3.5])
-            
-            # 0. מחק
-            with cols[0]:
-                st.markdown('<div class="icon-btn">', unsafe_allow_html=True)
-                if st.button("✕", key=f"del_{uid}"): to_del.append(i)
-                st.markdown('</div>', unsafe_allow_html=True)
+
+            # 0. בחירה
+            seed_widget(f"sel_{uid}", uid in sel)
+            cols[0].checkbox("בחר", key=f"sel_{uid}", on_change=toggle_selected, args=(uid, f"sel_{uid}"), label_visibility="collapsed")
 
             # 1. סדר
             with cols[1]:
                 st.markdown('<div class="icon-btn">', unsafe_allow_html=True)
                 c_u, c_d = st.columns(2)
-                if i>0 and c_u.button("▲", key=f"u_{uid}"): mv_up=i
-                if i<len(st.session_state.binder_files)-1 and c_d.button("▼", key=f"d_{uid}"): mv_dn=i
+                if i > 0: c_u.button("▲", key=f"u_{uid}", on_click=swap_rows, args=(i, i-1))
+                if i < len(files)-1: c_d.button("▼", key=f"d_{uid}", on_click=swap_rows, args=(i, i+1))
                 st.markdown('</div>', unsafe_allow_html=True)
 
             # 2. ראשי (כוכב)
-            with cols[2]:
-                is_m = st.checkbox("⭐", value=item.get('is_main', False), key=f"main_{uid}", label_visibility="collapsed")
-                if is_m != item.get('is_main', False): item['is_main'] = is_m; st.rerun()
+            seed_widget(f"main_{uid}", item.get('is_main', False))
+            cols[2].checkbox("⭐", key=f"main_{uid}", on_change=set_flag, args=(item, 'is_main', f"main_{uid}"), label_visibility="collapsed")
 
             # 3. מזג
             with cols[3]:
-                if not disable_merge:
-                    is_mg = st.checkbox("🔗", value=item.get('merge', False), key=f"m_{uid}", label_visibility="collapsed")
-                    if is_mg != item.get('merge', False): item['merge'] = is_mg; st.rerun()
+                if i > 0 and not item.get('is_main'):
+                    seed_widget(f"m_{uid}", item.get('merge', False))
+                    st.checkbox("🔗", key=f"m_{uid}", on_change=set_flag, args=(item, 'merge', f"m_{uid}"), label_visibility="collapsed")
                 else: st.write("")
 
             # 4. מספר
-            with cols[4]:
-                st.markdown(f"<div class='annex-num'>{display_num}</div>", unsafe_allow_html=True)
+            cols[4].markdown(f"<div class='annex-num'>{display_num}</div>", unsafe_allow_html=True)
 
             # 5. כותרת
-            with cols[5]:
-                ph = "תן כותרת..." 
-                item['title'] = st.text_input("hidden", item['title'], key=f"t_{uid}", label_visibility="collapsed", placeholder=ph)
+            seed_widget(f"t_{uid}", item['title'])
+            cols[5].text_input("hidden", key=f"t_{uid}", on_change=set_title, args=(item, f"t_{uid}"), label_visibility="collapsed", placeholder="תן כותרת...")
 
             # 6. שם קובץ
             with cols[6]:
                 ftype = item.get('ftype', 'PDF')
                 badge = "bg-word" if ftype=="WORD" else "bg-gdoc" if ftype=="GDOC" else "bg-pdf"
-                st.markdown(f"<span class='badge {badge}'>{ftype}</span> <span style='color:#333; font-size:13px;'>{item['name']}</span>", unsafe_allow_html=True)
+                pre = get_prefetcher().status(item) or {}
+                ready = {"pending": "<span class='ready-badge'>⏳</span>", "error": "<span class='ready-badge'>⚠️</span>",
+                         "ready": f"<span class='ready-badge ready'>✓ {pre.get('pages')} עמ'</span>"}.get(pre.get('state'), "")
+                if pre.get('rotated'): ready += f"<span class='ready-badge' title='עמודים מסובבים'>↻ {pre['rotated']}</span>"
+                st.markdown(f"<span class='badge {badge}'>{ftype}</span> <span style='color:#333; font-size:13px;'>{item['name']}</span> {ready}", unsafe_allow_html=True)
 
             st.markdown('</div>', unsafe_allow_html=True)
 
-    if mv_up is not None:
-        st.session_state.binder_files[mv_up], st.session_state.binder_files[mv_up-1] = st.session_state.binder_files[mv_up-1], st.session_state.binder_files[mv_up]
-        st.rerun()
-    if mv_dn is not None:
-        st.session_state.binder_files[mv_dn], st.session_state.binder_files[mv_dn+1] = st.session_state.binder_files[mv_dn+1], st.session_state.binder_files[mv_dn]
-        st.rerun()
-    if to_del:
-        for idx in sorted(to_del, reverse=True): del st.session_state.binder_files[idx]
-        st.rerun()
+    page_uids = [f['unique_id'] for f in files[start:start + size]]
+    p = st.columns([1, 1, 4])
+    p[0].button("☑️ בחר עמוד", on_click=select_rows, args=(page_uids, True))
+    if pages > 1:
+        p[1].selectbox("עמוד", range(pages), key="table_page", label_visibility="collapsed",
+                       format_func=lambda n: f"{n*size + 1}–{min((n+1)*size, len(files))} מתוך {len(files)}")
+
+if st.session_state.binder_files:
+    st.markdown("<br>", unsafe_allow_html=True)
+    show_prefetch(st.session_state.binder_files)
+    render_table()
 
     st.markdown('<div class="generate-btn">', unsafe_allow_html=True)
     if st.button("🚀 הפק קלסר ושמור בדרייב"):
-        status = st.empty(); bar = st.progress(0)
-        try:
-            status.info("📥 מוריד ומעבד...")
-            
-            # --- בניית בלוקים ---
-            blocks = []; current_block = []
-            for item in st.session_state.binder_files:
-                is_main = item.get('is_main', False)
-                is_merged = item.get('merge', False)
-                start_new = is_main or (not is_merged)
-                if start_new:
-                    if current_block: blocks.append(current_block)
-                    current_block = [item]
-                else: current_block.append(item)
-            if current_block: blocks.append(current_block)
-            
-            # --- עיבוד ---
-            processed_blocks = [] 
-            real_annex_counter = 0
-            total_items = len(st.session_state.binder_files)
-            prog = 0
-            
-            for block in blocks:
-                head = block[0]
-                is_main = head.get('is_main', False)
-                title = head['title'].strip()
-                block_writer = PdfWriter()
-                
-                if not is_main: real_annex_counter += 1
-                sub_count = 0
-                
-                for f in block:
-                    prog += 1; bar.progress((prog/total_items)*0.8)
-                    fh = download_file_content(f['id'], f.get('mime', 'application/pdf'))
-                    if fh:
-                        try:
-                            r = PdfReader(fh)
-                            for p in r.pages: block_writer.add_page(p)
-                            
-                            if rename_source and not is_main:
-                                sub_count += 1
-                                ext = Path(f['name']).suffix
-                                base = f"נספח {real_annex_counter} - {title}"
-                                new_n = f"{base} ({sub_count}){ext}" if len(block)>1 else f"{base}{ext}"
-                                try: 
-                                    if f['name'] != new_n: rename_drive_file(f['id'], new_n)
-                                except: pass
-                        except: st.warning(f"קובץ פגום: {f['name']}")
-
-                processed_blocks.append({
-                    "is_main": is_main,
-                    "annex_num": real_annex_counter if not is_main else None,
-                    "title": title,
-                    "writer": block_writer,
-                    "page_count": len(block_writer.pages)
-                })
-
-            # --- הרכבה ו-TOC ---
-            status.info("📑 בונה תוכן עניינים...")
-            toc_data = []
-            
-            # 1. חישוב מיקום התחלה של TOC (אחרי כל הראשיים)
-            main_pages_count = sum(b['page_count'] for b in processed_blocks if b['is_main'])
-            
-            # הערכת גודל TOC (נניח עמוד 1)
-            toc_length = 1
-            
-            # מונה רץ עבור המיקומים ב-TOC
-            # נספח 1 מתחיל ב: סך עמודי ראשיים + עמוד TOC + 1 (כי יש שער לנספח 1)
-            # כלומר: העמוד שבו *המסמך* מתחיל.
-            
-            # המונה יתחיל לרוץ אחרי הראשיים וה-TOC
-            running_page_after_toc = main_pages_count + toc_length + 1 
-            
-            # בונים את המידע לטבלה
-            for blk in processed_blocks:
-                if not blk['is_main']:
-                    # זה נספח
-                    # הוא מתחיל ב-running_page_after_toc (שזה השער)
-                    # המסמך עצמו מתחיל ב running_page_after_toc + 1
-                    
-                    doc_start_page = running_page_after_toc + 1
-                    
-                    toc_data.append({
-                        "num": blk['annex_num'], 
-                        "title": blk['title'], 
-                        "page": running_page_after_toc # בתוכן עניינים מציינים את עמוד השער
-                    })
-                    
-                    # מקדמים את המונה: שער (1) + דפי המסמך
-                    running_page_after_toc += 1 + blk['page_count']
-
-            toc_bytes = html_to_pdf(generate_toc_html(toc_data))
-            
-            # --- איחוד פיזי ---
-            master = PdfWriter()
-            
-            # א. הוספת ראשיים
-            for blk in processed_blocks:
-                if blk['is_main']:
-                    temp = io.BytesIO(); blk['writer'].write(temp); temp.seek(0)
-                    br = PdfReader(temp)
-                    for p in br.pages: master.add_page(p)
-            
-            # ב. הוספת TOC
-            if toc_bytes:
-                tr = PdfReader(io.BytesIO(toc_bytes))
-                for p in tr.pages: master.add_page(p)
-                
-            # ג. הוספת נספחים
-            # אנחנו צריכים לחשב מחדש את מספר העמוד שיופיע על השער
-            # מספר העמוד בשער צריך להיות: העמוד הנוכחי + 1 + 1 (לא, רגע)
-            # אם אני בעמוד 10 (שער), המסמך מתחיל ב-11. בשער כתוב "עמוד 11".
-            
-            # נשתמש במונה מדויק תוך כדי בנייה
-            current_pdf_page = len(master.pages) + 1
-            
-            for blk in processed_blocks:
-                if not blk['is_main']:
-                    # אנחנו בעמוד השער. המסמך יתחיל בעמוד הבא.
-                    target_doc_page = current_pdf_page + 1
-                    
-                    cover = html_to_pdf(generate_cover_html(blk['annex_num'], blk['title'], target_doc_page))
-                    if cover:
-                        cr = PdfReader(io.BytesIO(cover))
-                        for p in cr.pages: master.add_page(p)
-                        current_pdf_page += 1
-                    
-                    temp = io.BytesIO(); blk['writer'].write(temp); temp.seek(0)
-                    br = PdfReader(temp)
-                    for p in br.pages: master.add_page(p)
-                    current_pdf_page += len(br.pages)
-
-            out_io = io.BytesIO(); master.write(out_io)
-            
-            status.info("🔢 מסיים...")
-            res = compress_if_needed(add_footer_numbers(out_io.getvalue()))
-            
-            status.info("☁️ מעלה...")
-            try:
-                upload_final_pdf(st.session_state.folder_id, res, f"{final_name}.pdf")
-                bar.progress(100)
-                st.balloons()
-                status.success(f"✅ בוצע!")
-            except Exception as e:
-                status.warning(f"העלאה נכשלה ({e}). הורד ידנית:")
-                st.download_button("📥 הורד", res, f"{final_name}.pdf")
-        except Exception as e: st.error(f"שגיאה: {e}")
+        # הבנייה רצה ברקע; מזהה העבודה נשמר בכתובת כדי שרענון הדפדפן לא יאבד אותה
+        st.query_params['job'] = get_job_queue().submit({
+            "files": st.session_state.binder_files, "folder_id": st.session_state.folder_id, "name": final_name,
+            "rename_source": rename_source, "spool_to_disk": spool_to_disk, "update_existing": update_existing, "target_mb": target_mb,
+            "linearize": linearize})
     st.markdown('</div>', unsafe_allow_html=True)
+
+if st.query_params.get('job'): show_job(st.query_params['job'])
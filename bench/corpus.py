@@ -0,0 +1,84 @@
+# קורפוס סינתטי לבנצ'מרק: קובצי PDF (טקסט, עמודים סרוקים, עמודים מסובבים), קובצי וורד (OOXML גולמי)
+# ומסמכי גוגל, בתיקייה (ואופציונלית בתתי-תיקיות) של FakeDrive. הכל נגזר מ-seed, כך שאותם פרמטרים
+# נותנים בדיוק את אותו קורפוס
+import io
+import random
+import zipfile
+from PIL import Image, ImageDraw
+from pypdf import PdfReader, PdfWriter
+from reportlab import rl_config
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from binder_engine import DOCX_MIME
+
+# תמונות נשמרות כ-DCT נקי, כמו בסורקים, ולא עטופות ב-ASCII85
+rl_config.useA85 = 0
+
+LOREM = ("court hearing exhibit evidence statement witness agreement clause section appendix "
+         "plaintiff defendant motion order judgment claim affidavit protocol").split()
+
+def scanned_page(rng, dpi):
+    # "סריקה": דף אפור עם שורות טקסט מטושטשות ורעש, בגודל A4 ברזולוציה הנתונה
+    w, h = int(8.27 * dpi), int(11.69 * dpi)
+    img = Image.effect_noise((w, h), 24).point(lambda v: 200 + v // 8)
+    draw = ImageDraw.Draw(img)
+    for y in range(int(dpi), h - int(dpi), max(8, dpi // 6)):
+        draw.line([(int(dpi * 0.8), y), (int(dpi * 0.8) + rng.randint(w // 3, w - 2 * int(dpi)), y)], fill=rng.randint(20, 80), width=max(1, dpi // 50))
+    return img
+
+def make_pdf(rng, pages, scanned=False, rotated=0.0, dpi=150):
+    buf = io.BytesIO(); can = canvas.Canvas(buf, pagesize=A4)
+    for n in range(pages):
+        if scanned:
+            jpeg = io.BytesIO(); scanned_page(rng, dpi).save(jpeg, 'JPEG', quality=75)
+            can.drawImage(ImageReader(jpeg), 0, 0, *A4)
+        else:
+            text = can.beginText(60, 780)
+            for _ in range(45): text.textLine(' '.join(rng.choices(LOREM, k=rng.randint(6, 12))))
+            can.drawText(text)
+        can.drawString(60, 40, f"page {n + 1}"); can.showPage()
+    can.save()
+    if not rotated: return buf.getvalue()
+    writer = PdfWriter(clone_from=PdfReader(buf))
+    for page in writer.pages:
+        if rng.random() < rotated: page.rotate(rng.choice((90, 180, 270)))
+    out = io.BytesIO(); writer.write(out); return out.getvalue()
+
+def make_docx(rng, paragraphs):
+    # מסמך וורד מינימלי וחוקי, נכתב ישירות כ-OOXML
+    body = ''.join(f"<w:p><w:r><w:t>{' '.join(rng.choices(LOREM, k=rng.randint(10, 30)))}</w:t></w:r></w:p>" for _ in range(paragraphs))
+    files = {
+        '[Content_Types].xml': '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>',
+        '_rels/.rels': '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+            '</Relationships>',
+        'word/document.xml': '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f'<w:body>{body}</w:body></w:document>',
+    }
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, data in files.items(): z.writestr(name, data)
+    return buf.getvalue()
+
+def build_corpus(drive, files=40, pages=8, scanned=0.25, rotated=0.1, docx=0.1, gdocs=0.05, subfolders=0, dpi=150, seed=0):
+    # scanned/docx/gdocs הם שיעור הקבצים מכל סוג; rotated הוא שיעור העמודים המסובבים בקובצי ה-PDF.
+    # מחזיר את מזהה תיקיית השורש
+    rng = random.Random(seed)
+    root = drive.add_folder('bench')
+    folders = [root] + [drive.add_folder(f'sub{n}', root) for n in range(subfolders)]
+    for n in range(files):
+        parent = folders[n % len(folders)]; kind = rng.random(); count = max(1, round(rng.gauss(pages, pages / 3)))
+        if kind < docx: drive.add_file(f"doc_{n:04}.docx", make_docx(rng, count * 12), DOCX_MIME, parent)
+        elif kind < docx + gdocs: drive.add_file(f"gdoc_{n:04}", make_pdf(rng, count), 'application/vnd.google-apps.document', parent)
+        else:
+            is_scan = rng.random() < scanned / max(1e-9, 1 - docx - gdocs)
+            drive.add_file(f"{'scan' if is_scan else 'file'}_{n:04}.pdf", make_pdf(rng, count, is_scan, rotated, dpi), 'application/pdf', parent)
+    return root
@@ -0,0 +1,154 @@
+# דרייב מקומי בזיכרון לבנצ'מרק: מממש ברמת ה-HTTP את מה שהמנוע משתמש בו (files.list/get/get_media/
+# export_media/create/update כולל העלאה מתחדשת, changes ו-batch), כך שהלקוח האמיתי של googleapiclient
+# רץ מולו בלי שינוי. השהיה ורוחב פס מדומים כדי שההורדות המקבילות יתנהגו כמו ברשת
+import json
+import re
+import threading
+import time
+import uuid
+import hashlib
+from email.parser import Parser
+from urllib.parse import urlsplit, parse_qs, unquote
+import httplib2
+import binder_engine
+from googleapiclient.discovery import build_from_document
+
+FOLDER_MIME = binder_engine.FOLDER_MIME
+
+class FakeDrive:
+    def __init__(self, latency=0.0, bandwidth_mbps=0.0):
+        self.latency = latency; self.bandwidth = bandwidth_mbps * 1024 * 1024
+        self.files = {}; self.content = {}; self.changes = []; self.requests = 0
+        self._uploads = {}; self._lock = threading.Lock(); self._clock = 0; self._clients = threading.local()
+
+    # --- תוכן ---
+    def _stamp(self):
+        self._clock += 1
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(1700000000 + self._clock)) + '.000Z'
+
+    def _put(self, meta, data=None):
+        with self._lock:
+            meta.setdefault('createdTime', self._stamp()); meta['modifiedTime'] = self._stamp()
+            meta['headRevisionId'] = uuid.uuid4().hex; meta.setdefault('trashed', False)
+            if data is not None: self.content[meta['id']] = data; meta['md5Checksum'] = hashlib.md5(data).hexdigest()
+            self.files[meta['id']] = meta; self.changes.append(meta['id'])
+            return meta
+
+    def add_folder(self, name, parent=None):
+        return self._put({'id': uuid.uuid4().hex, 'name': name, 'mimeType': FOLDER_MIME, 'parents': [parent] if parent else []})['id']
+
+    def add_file(self, name, data, mime, parent):
+        # קובץ גוגל (google-apps) שומר את ה-PDF שמוחזר בייצוא
+        return self._put({'id': uuid.uuid4().hex, 'name': name, 'mimeType': mime, 'parents': [parent]}, data)['id']
+
+    def update_file(self, file_id, data=None, **fields):
+        return self._put({**self.files[file_id], **fields}, data)
+
+    # --- לקוח ---
+    def service(self):
+        # לקוח לכל תהליכון, כמו get_drive_service של המנוע
+        if getattr(self._clients, 'service', None) is None:
+            self._clients.service = build_from_document(binder_engine.get_drive_discovery(), http=FakeDriveHttp(self))
+        return self._clients.service
+
+    def install(self):
+        binder_engine.get_drive_service = self.service
+        return self
+
+    # --- HTTP ---
+    def handle(self, uri, method, body, headers):
+        self.requests += 1
+        if self.latency: time.sleep(self.latency)
+        parts = urlsplit(uri); path = unquote(parts.path); qs = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        if isinstance(body, bytes) and not path.startswith('/upload/') and not parts.netloc.startswith('fake-upload'): body = body.decode()
+        if parts.netloc.startswith('fake-upload'): return self._upload_chunk(path.strip('/'), body, headers)
+        if path == '/batch/drive/v3': return self._batch(body, headers)
+        if path.startswith('/upload/drive/v3/files'): return self._upload_start(method, path, body)
+        if path == '/drive/v3/changes/startPageToken': return self._json({'startPageToken': str(len(self.changes))})
+        if path == '/drive/v3/changes': return self._changes(qs)
+        if path == '/drive/v3/files' and method == 'GET': return self._list(qs)
+        m = re.fullmatch(r'/drive/v3/files/([^/]+)(/export)?', path)
+        if not m or m.group(1) not in self.files: return self._error(404, 'File not found')
+        file_id = m.group(1)
+        if method == 'PATCH': return self._json(self._patch(file_id, json.loads(body or '{}')))
+        if qs.get('alt') == 'media' or m.group(2): return self._media(file_id, headers)
+        return self._json({'id': file_id, **({'driveId': None} if 'driveId' in qs.get('fields', '') else self.files[file_id])})
+
+    def _json(self, payload, status=200, extra=None):
+        return httplib2.Response({'status': status, 'content-type': 'application/json', **(extra or {})}), json.dumps(payload).encode()
+
+    def _error(self, status, message):
+        return self._json({'error': {'code': status, 'message': message}}, status)
+
+    def _list(self, qs):
+        q = qs.get('q', ''); parents = re.findall(r"'([^']+)' in parents", q)
+        name = re.search(r"name='((?:[^'\\]|\\.)*)'", q)
+        name = re.sub(r"\\(.)", r"\1", name.group(1)) if name else None
+        with self._lock: files = list(self.files.values())
+        out = [f for f in files if not f['trashed'] and (not parents or parents[0] in f['parents'])
+               and (name is None or f['name'] == name)
+               and ('mimeType' not in q or binder_engine.is_binder_mime(f['mimeType']) or f['mimeType'] == FOLDER_MIME)]
+        order = qs.get('orderBy', 'createdTime'); desc = order.endswith(' desc')
+        out.sort(key=lambda f: f.get(order.split()[0], ''), reverse=desc)
+        start = int(qs.get('pageToken') or 0); size = int(qs.get('pageSize') or 100)
+        page = {'files': out[start:start+size]}
+        if start + size < len(out): page['nextPageToken'] = str(start + size)
+        return self._json(page)
+
+    def _changes(self, qs):
+        start = int(qs['pageToken']); size = int(qs.get('pageSize') or 100)
+        with self._lock: ids = self.changes[start:start+size]; total = len(self.changes)
+        page = {'changes': [{'fileId': i, 'removed': False, 'file': self.files[i]} for i in ids]}
+        if start + size < total: page['nextPageToken'] = str(start + size)
+        else: page['newStartPageToken'] = str(total)
+        return self._json(page)
+
+    def _media(self, file_id, headers):
+        data = self.content.get(file_id, b'')
+        rng = re.match(r'bytes=(\d+)-(\d+)', (headers or {}).get('range', ''))
+        lo, hi = (int(rng.group(1)), min(int(rng.group(2)), len(data) - 1)) if rng else (0, len(data) - 1)
+        chunk = data[lo:hi+1]
+        if self.bandwidth: time.sleep(len(chunk) / self.bandwidth)
+        return httplib2.Response({'status': 206, 'content-range': f"bytes {lo}-{hi}/{len(data)}", 'content-length': str(len(chunk))}), chunk
+
+    def _patch(self, file_id, body):
+        return self.update_file(file_id, **{k: v for k, v in body.items() if k == 'name'})
+
+    def _upload_start(self, method, path, body):
+        meta = json.loads(body or '{}') if body else {}
+        file_id = path.rsplit('/', 1)[1] if method == 'PATCH' else None
+        upload_id = uuid.uuid4().hex
+        self._uploads[upload_id] = {'file_id': file_id, 'meta': meta, 'data': bytearray()}
+        return httplib2.Response({'status': 200, 'location': f"https://fake-upload/{upload_id}"}), b''
+
+    def _upload_chunk(self, upload_id, body, headers):
+        up = self._uploads[upload_id]; data = body if isinstance(body, bytes) else (body.read() if hasattr(body, 'read') else body.encode())
+        if self.bandwidth: time.sleep(len(data) / self.bandwidth)
+        up['data'] += data
+        total = re.search(r'/(\d+|\*)$', headers.get('Content-Range', headers.get('content-range', '')))
+        if total and total.group(1) != '*' and len(up['data']) >= int(total.group(1)):
+            del self._uploads[upload_id]
+            if up['file_id']: meta = self.update_file(up['file_id'], bytes(up['data']))
+            else: meta = self._put({'id': uuid.uuid4().hex, 'mimeType': 'application/pdf', 'parents': [], **up['meta']}, bytes(up['data']))
+            return self._json({'id': meta['id']})
+        return httplib2.Response({'status': 308, 'range': f"bytes=0-{len(up['data']) - 1}"}), b''
+
+    def _batch(self, body, headers):
+        msg = Parser().parsestr(f"content-type: {headers['content-type']}\r\n\r\n{body}")
+        boundary = uuid.uuid4().hex; out = []
+        for part in msg.get_payload():
+            request_line, rest = part.get_payload().split('\n', 1)
+            method, target, _ = request_line.split(' ', 2)
+            sub_body = rest.split('\r\n\r\n', 1)[1] if '\r\n\r\n' in rest else rest.split('\n\n', 1)[-1]
+            resp, content = self.handle(f"https://www.googleapis.com{target}", method, sub_body, {})
+            content_id = re.sub(r'\r?\n', '', part['Content-ID'])[1:-1]
+            out.append(f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                       f"HTTP/1.1 {resp.status} OK\r\nContent-Type: application/json\r\n\r\n{content.decode()}\r\n")
+        return httplib2.Response({'status': 200, 'content-type': f'multipart/mixed; boundary={boundary}'}), (''.join(out) + f"--{boundary}--").encode()
+
+class FakeDriveHttp:
+    # מחליף את httplib2.Http: כל בקשה מטופלת ישירות ב-FakeDrive
+    def __init__(self, drive): self.drive = drive; self.timeout = None
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        return self.drive.handle(uri, method, body, headers or {})
@@ -0,0 +1,127 @@
+# בנצ'מרק מקצה לקצה מול FakeDrive: משיכת תיקייה, בנייה קרה (בלי מטמון), חמה (מטמון PDF מלא)
+# ומצטברת (כותרת אחת השתנתה), כל אחת כולל העלאה. הדוח הוא JSON עם זמן חציוני לכל תרחיש ופירוק לשלבים,
+# וכשניתן --baseline מודפסת השוואה והיציאה היא 1 אם תרחיש כלשהו האט מעבר לסף.
+#   python -m bench.run --files 60 --pages 10 --out bench.json
+#   python -m bench.run --baseline bench.json
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+def git_commit():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except OSError: return None
+
+def make_items(engine, files):
+    # הראשון ראשי, כל שישי ממוזג לקודם, ולכל נספח כותרת
+    items = [engine.binder_item(f) for f in files]
+    for n, item in enumerate(items):
+        item['is_main'] = n == 0; item['merge'] = n > 1 and n % 6 == 0; item['title'] = f"מסמך {n}"
+    return items
+
+def clear_dir(path):
+    shutil.rmtree(path, ignore_errors=True); os.makedirs(path, exist_ok=True)
+
+def run_build(engine, items, folder_id, args, name='bench'):
+    trace = engine.BuildTrace(); warnings = []
+    with TemporaryDirectory(prefix='bench_spool_') as spool:
+        out = engine.build_binder(items, folder_id, name, spool_dir=spool if args.spool else None, target_mb=args.target_mb, linearize=args.linearize,
+                                  on_warning=warnings.append, trace=trace)
+        with trace.span('upload', bytes=engine.payload_bytes(out)):
+            engine.upload_final_pdf(folder_id, out, f"{name}.pdf", update_existing=True)
+        pages = len(engine.PdfReader(out if isinstance(out, str) else io.BytesIO(out)).pages)
+    report = trace.report()
+    return {'wall': report['total'], 'stages': {s['stage']: s['wall'] for s in report['stages']}, 'peak_rss_mb': report['peak_rss_mb'],
+            'pages': pages, 'bytes': engine.payload_bytes(out) if not isinstance(out, str) else None, 'errors': len(report['errors']),
+            'warnings': len(warnings)}
+
+def run_suite(args):
+    work = TemporaryDirectory(prefix='binder_bench_')
+    for name, sub in (('cache_dir', 'cache'), ('builds_dir', 'builds')): os.environ[name.upper()] = os.path.join(work.name, sub)
+    import binder_engine as engine
+    from bench.fake_drive import FakeDrive
+    from bench.corpus import build_corpus
+    engine.quiet_bare_mode()
+    drive = FakeDrive(latency=args.latency, bandwidth_mbps=args.bandwidth).install()
+    started = time.perf_counter()
+    root = build_corpus(drive, files=args.files, pages=args.pages, scanned=args.scanned, rotated=args.rotated,
+                        docx=args.docx, gdocs=args.gdocs, subfolders=args.subfolders, dpi=args.dpi, seed=args.seed)
+    print(f"corpus: {args.files} files, {sum(map(len, drive.content.values())) / 1e6:.1f}MB in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    runs = {}
+    for rep in range(args.repeat):
+        engine.get_listing_cache.clear()
+        t = time.perf_counter(); _, files = engine.list_files_from_drive(root, recursive=args.subfolders > 0)
+        runs.setdefault('list', []).append({'wall': round(time.perf_counter() - t, 4), 'stages': {}, 'files': len(files)})
+        items = make_items(engine, files)
+        clear_dir(os.environ['CACHE_DIR']); clear_dir(os.environ['BUILDS_DIR'])
+        # גם המטמונים שבזיכרון (מטמון הפריסה נטען מהדיסק פעם אחת), אחרת מהחזרה השנייה הבנייה הקרה כבר לא קרה
+        engine.get_pdf_cache.clear(); engine.get_layout_cache.clear()
+        runs.setdefault('cold', []).append(run_build(engine, items, root, args))
+        clear_dir(os.environ['BUILDS_DIR'])
+        runs.setdefault('warm', []).append(run_build(engine, items, root, args))
+        items[len(items) // 2]['title'] += " (מתוקן)"
+        runs.setdefault('incremental', []).append(run_build(engine, items, root, args))
+        print(f"repeat {rep + 1}/{args.repeat}: " + ', '.join(f"{k} {v[-1]['wall']:.2f}s" for k, v in runs.items()), file=sys.stderr)
+    work.cleanup()
+    scenarios = {}
+    for name, samples in runs.items():
+        median = sorted(samples, key=lambda r: r['wall'])[len(samples) // 2]
+        scenarios[name] = {**median, 'wall': round(statistics.median(r['wall'] for r in samples), 4), 'runs': [r['wall'] for r in samples]}
+    meta = {k: v for k, v in vars(args).items() if k not in ('out', 'baseline', 'tolerance')}
+    return {'meta': {**meta, 'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+                     'cpus': os.cpu_count(), 'drive_requests': drive.requests}, 'scenarios': scenarios}
+
+def compare(report, baseline, tolerance, floor=0.05):
+    # מחזיר את רשימת התרחישים שהאטו ביותר מ-tolerance (ובלפחות floor שניות, מתחת לזה זה רעש)
+    regressions = []
+    print(f"{'scenario':<14}{'baseline':>10}{'current':>10}{'change':>9}")
+    for name, cur in report['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base: print(f"{name:<14}{'-':>10}{cur['wall']:>10.3f}"); continue
+        change = (cur['wall'] - base['wall']) / base['wall'] if base['wall'] else 0
+        slower = change > tolerance and cur['wall'] - base['wall'] > floor
+        if slower: regressions.append(name)
+        print(f"{name:<14}{base['wall']:>10.3f}{cur['wall']:>10.3f}{change:>+9.1%}{'  ⚠' if slower else ''}")
+        for stage in sorted(set(cur['stages']) | set(base.get('stages', {}))):
+            b, c = base.get('stages', {}).get(stage), cur['stages'].get(stage)
+            if b is not None and c is not None and abs(c - b) > floor: print(f"  {stage:<12}{b:>10.3f}{c:>10.3f}{(c - b) / b if b else 0:>+9.1%}")
+    if baseline.get('meta', {}).get('files') != report['meta']['files'] or baseline.get('meta', {}).get('pages') != report['meta']['pages']:
+        print("note: baseline was taken with a different corpus", file=sys.stderr)
+    return regressions
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Binder build benchmark against a local fake Drive")
+    p.add_argument('--files', type=int, default=40); p.add_argument('--pages', type=int, default=8, help="mean pages per file")
+    p.add_argument('--scanned', type=float, default=0.25, help="fraction of files that are scanned images")
+    p.add_argument('--rotated', type=float, default=0.1, help="fraction of PDF pages that are rotated")
+    p.add_argument('--docx', type=float, default=0.1); p.add_argument('--gdocs', type=float, default=0.05)
+    p.add_argument('--subfolders', type=int, default=0); p.add_argument('--dpi', type=int, default=150)
+    p.add_argument('--seed', type=int, default=0); p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--latency', type=float, default=0.02, help="simulated seconds per Drive request")
+    p.add_argument('--bandwidth', type=float, default=50, help="simulated MB/s, 0 = unlimited")
+    p.add_argument('--spool', action='store_true', help="build with the sources spooled to disk and the binder written to a file")
+    p.add_argument('--target-mb', type=float, default=25)
+    p.add_argument('--linearize', action='store_true', help="write linearized output (needs qpdf)")
+    p.add_argument('--out', help="write the JSON report here"); p.add_argument('--baseline', help="JSON report to compare against")
+    p.add_argument('--tolerance', type=float, default=0.15, help="allowed slowdown before failing (0.15 = 15%%)")
+    args = p.parse_args(argv)
+    report = run_suite(args)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f: json.dump(report, f, ensure_ascii=False, indent=2)
+    if not args.baseline:
+        print(json.dumps({k: v['wall'] for k, v in report['scenarios'].items()}))
+        return 0
+    with open(args.baseline, encoding='utf-8') as f: baseline = json.load(f)
+    regressions = compare(report, baseline, args.tolerance)
+    if regressions: print(f"regressions: {', '.join(regressions)}", file=sys.stderr); return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
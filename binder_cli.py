@@ -0,0 +1,143 @@
+# בניית קלסרים משורת הפקודה, בלי הממשק: מניפסט JSON/YAML עם רשימת קלסרים, שנבנים במקביל
+# במאגר תהליכים. ההרשאות מ-GCP_KEY (תוכן ה-JSON) או מקובץ ב-GCP_KEY_FILE / GOOGLE_APPLICATION_CREDENTIALS.
+#
+#   python binder_cli.py month_end.yaml --jobs 4 --report summary.json
+#   python binder_cli.py month_end.yaml --out-dir out    # out/<מזהה תיקייה>/<שם>.pdf, בלי העלאה
+#
+# מבנה המניפסט (ברירות המחדל של כל קלסר אפשר לתת ב-defaults):
+#   defaults: {rename_source: false, update_existing: true, spool_to_disk: true, target_mb: 25, linearize: true}
+#   binders:
+#     - folder: <מזהה או לינק לתיקייה>
+#       name: קלסר_נספחים
+#       recursive: false
+#       files:                  # אופציונלי: הסדר והכותרות. בלי files נלקחים כל הקבצים בסדר של התיקייה
+#         - {name: כתב תביעה.pdf, main: true}
+#         - {id: 1AbC..., title: הסכם שכירות}
+#         - {name: נספח המשך.pdf, merge: true}
+#
+# קוד יציאה: 0 הכל נבנה, 1 לפחות קלסר אחד נכשל (או היו אזהרות, עם --strict), 2 מניפסט לא תקין
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tempfile import TemporaryDirectory
+
+BINDER_OPTIONS = ('recursive', 'rename_source', 'update_existing', 'spool_to_disk', 'target_mb', 'linearize')
+
+class ManifestError(Exception): pass
+
+def load_manifest(path):
+    with open(path, encoding='utf-8') as f: text = f.read()
+    if path.endswith(('.yaml', '.yml')):
+        try: import yaml
+        except ImportError: raise ManifestError("YAML manifests need PyYAML (pip install pyyaml), or use JSON")
+        data = yaml.safe_load(text)
+    else: data = json.loads(text)
+    if isinstance(data, list): data = {'binders': data}
+    if not isinstance(data, dict) or not isinstance(data.get('binders'), list) or not data['binders']:
+        raise ManifestError("manifest must have a non-empty 'binders' list")
+    defaults = data.get('defaults') or {}
+    specs = []
+    for n, spec in enumerate(data['binders']):
+        if not isinstance(spec, dict) or not spec.get('folder') or not spec.get('name'):
+            raise ManifestError(f"binder #{n + 1}: 'folder' and 'name' are required")
+        for entry in spec.get('files') or []:
+            if not isinstance(entry, dict) or not (entry.get('id') or entry.get('name')):
+                raise ManifestError(f"binder '{spec['name']}': every file needs an 'id' or a 'name'")
+        specs.append({**{k: v for k, v in defaults.items() if k in BINDER_OPTIONS}, **spec})
+    from binder_engine import folder_id_from_link
+    targets = [(folder_id_from_link(s['folder']) or s['folder'], s['name']) for s in specs]
+    dup = sorted({name for folder, name in targets if targets.count((folder, name)) > 1})
+    if dup: raise ManifestError(f"the same output name appears twice in one folder: {', '.join(dup)}")
+    return specs
+
+def select_items(engine, spec, listing):
+    # השורות של הקלסר לפי files במניפסט (סדר, כותרת, ראשי, מיזוג), או כל התיקייה כמו שהיא
+    items = [engine.binder_item(f) for f in listing]
+    if not spec.get('files'): return items
+    by_id = {i['id']: i for i in items}; by_name = {}
+    for i in items: by_name.setdefault(i['name'], i)
+    selected = []
+    for entry in spec['files']:
+        item = by_id.get(entry.get('id')) or by_name.get(entry.get('name'))
+        if item is None: raise ManifestError(f"file not found in folder: {entry.get('id') or entry.get('name')}")
+        selected.append({**item, 'title': entry.get('title', ''), 'is_main': bool(entry.get('main')),
+                         'merge': bool(entry.get('merge')) and not entry.get('main') and bool(selected)})
+    return selected
+
+def build_one(spec, out_dir=None, trace_log=None):
+    # רץ בתהליך נפרד; מחזיר שורת סיכום ולא זורק
+    import binder_engine as engine
+    engine.quiet_bare_mode()
+    started = time.time(); warnings = []; trace = engine.BuildTrace()
+    summary = {'name': spec['name'], 'folder': spec['folder'], 'status': 'failed', 'warnings': warnings}
+    try:
+        # תקלה בהרשאות או בחיבור לדרייב נזרקת כאן עם הסיבה שלה, ולא נראית כמו מניפסט שגוי
+        with trace.span('connect'): engine.get_drive_service()
+        with trace.span('list'):
+            folder_id, listing = engine.list_files_from_drive(spec['folder'], recursive=spec.get('recursive', False))
+        if not folder_id: raise ManifestError(f"cannot list folder: {listing}")
+        items = select_items(engine, spec, listing)
+        if not items: raise ManifestError("no files to bind")
+        with TemporaryDirectory(prefix='binder_') as spool:
+            out = engine.build_binder(items, folder_id, spec['name'], rename_source=spec.get('rename_source', False),
+                                      spool_dir=spool if spec.get('spool_to_disk', True) else None, target_mb=spec.get('target_mb'),
+                                      linearize=spec.get('linearize', True), on_warning=warnings.append, trace=trace)
+            summary['bytes'] = engine.payload_bytes(out)
+            if out_dir:
+                # תיקיית משנה לכל תיקיית מקור: אותו שם קלסר (ברירת המחדל קלסר_נספחים) חוזר בהרבה תיקים
+                path = os.path.join(out_dir, folder_id, f"{spec['name']}.pdf"); os.makedirs(os.path.dirname(path), exist_ok=True)
+                if isinstance(out, str): shutil.move(out, path)  # ה-spool יכול להיות במערכת קבצים אחרת (tmpfs)
+                else:
+                    with open(path, 'wb') as f: f.write(out)
+                summary['output'] = path
+            else:
+                with trace.span('upload', bytes=summary['bytes']):
+                    summary['file_id'] = engine.upload_final_pdf(folder_id, out, f"{spec['name']}.pdf", update_existing=spec.get('update_existing', True))
+        summary['status'] = 'done'
+    except Exception as e: summary['error'] = f"{type(e).__name__}: {e}"
+    report = trace.report()
+    summary['seconds'] = round(time.time() - started, 2); summary['peak_rss_mb'] = report['peak_rss_mb']
+    summary['stages'] = {s['stage']: s['wall'] for s in report['stages']}
+    trace.write(trace_log, name=spec['name'], folder=spec['folder'])
+    return summary
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Build binders from a JSON/YAML manifest without the web UI")
+    p.add_argument('manifest')
+    p.add_argument('--jobs', type=int, default=max(1, min(4, os.cpu_count() or 1)), help="binders built in parallel (processes)")
+    p.add_argument('--out-dir', help="save the PDFs here (one subdirectory per folder id) instead of uploading them to Drive")
+    p.add_argument('--report', help="write the JSON summary here")
+    p.add_argument('--trace-log', help="append per-stage spans (JSON lines) here")
+    p.add_argument('--strict', action='store_true', help="exit 1 when a binder finished with warnings")
+    args = p.parse_args(argv)
+    try: specs = load_manifest(args.manifest)
+    except (OSError, ValueError, ManifestError) as e: print(f"manifest error: {e}", file=sys.stderr); return 2
+    if args.out_dir: os.makedirs(args.out_dir, exist_ok=True)
+
+    results = [None] * len(specs)
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(specs)))) as pool:
+        futs = {pool.submit(build_one, spec, args.out_dir, args.trace_log): n for n, spec in enumerate(specs)}
+        for fut in as_completed(futs):
+            spec = specs[futs[fut]]
+            # תהליך שקרס (למשל חוסר זיכרון) נרשם ככישלון של הקלסר שלו בלבד
+            try: res = fut.result()
+            except Exception as e: res = {'name': spec['name'], 'folder': spec['folder'], 'status': 'failed', 'error': f"{type(e).__name__}: {e}", 'warnings': []}
+            results[futs[fut]] = res
+            mark = '✓' if res['status'] == 'done' else '✗'
+            print(f"{mark} {res['name']}  {res.get('seconds', 0):.1f}s" + (f"  {res['error']}" if res.get('error') else '')
+                  + (f"  ({len(res['warnings'])} warnings)" if res['warnings'] else ''), flush=True)
+
+    failed = [r for r in results if r['status'] != 'done']; warned = [r for r in results if r['warnings']]
+    print(f"\n{len(results) - len(failed)}/{len(results)} built, {len(failed)} failed, {len(warned)} with warnings")
+    for r in warned:
+        for w in r['warnings']: print(f"  {r['name']}: {w}")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f: json.dump(results, f, ensure_ascii=False, indent=2)
+    return 1 if failed or (args.strict and warned) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1334 @@
+# מנוע הקלסרים: דרייב, המרה, הרכבת PDF ותור הבנייה. בלי ממשק, כך שאפשר לייבא אותו
+# מהאפליקציה, משורת הפקודה ומהבנצ'מרק. st משמש כאן רק למטמון המשאבים המשותפים ול-secrets
+import streamlit as st
+from streamlit.errors import StreamlitSecretNotFoundError
+import io
+import re
+import json
+import logging
+import uuid
+import os
+import shutil
+import subprocess
+import mmap
+import queue
+import hashlib
+import threading
+import sqlite3
+import time
+import random
+import httplib2
+from pathlib import Path
+from contextlib import closing, contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from google.oauth2 import service_account
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload, MediaFileUpload
+from pypdf import PdfReader, PdfWriter
+from pypdf.annotations import Link
+from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+from PIL import Image
+from reportlab.pdfgen import canvas
+from reportlab.lib.units import mm
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from tempfile import NamedTemporaryFile, TemporaryDirectory, gettempdir
+
+# ==========================================
+# 1. הגדרות ומנוע גוגל דרייב
+# ==========================================
+def get_setting(name, default):
+    # הגדרה מ-secrets, אחרת ממשתנה סביבה (באותיות גדולות), אחרת ברירת מחדל
+    try: val = st.secrets.get(name, os.environ.get(name.upper(), default))
+    except (FileNotFoundError, StreamlitSecretNotFoundError): val = os.environ.get(name.upper(), default)  # אין secrets.toml
+    if isinstance(default, bool): return str(val).strip().lower() in ('1', 'true', 'yes', 'on')
+    return type(default)(val)
+
+def quiet_bare_mode():
+    # מחוץ לשרת streamlit (שורת פקודה, בנצ'מרק) כל גישה למטמון המשאבים מזהירה שאין ScriptRunContext.
+    # streamlit מאפס את רמות הלוגרים שלו כשהוא טוען הגדרות, ולכן מסנן ולא setLevel
+    logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').addFilter(lambda r: 'ScriptRunContext' not in r.getMessage())
+
+def rss_mb():
+    # הזיכרון שהתהליך מחזיק עכשיו (RSS מ-/proc; 0 במערכת בלי /proc). לא ru_maxrss: זה השיא מתחילת חיי
+    # התהליך, ובשרת או בתהליך CLI שבונה כמה קלסרים הוא מראה את השיא של בנייה קודמת
+    try:
+        with open('/proc/self/statm') as f: return round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024, 1)
+    except (OSError, ValueError, IndexError): return 0.0
+
+def payload_bytes(obj):
+    if obj is None: return 0
+    if isinstance(obj, (list, tuple)): return sum(map(payload_bytes, obj))
+    if isinstance(obj, io.BytesIO): return obj.getbuffer().nbytes
+    if isinstance(obj, str): return os.path.getsize(obj) if os.path.exists(obj) else 0
+    try: return len(obj)
+    except TypeError: return 0
+
+class BuildTrace:
+    # מדידה של בנייה אחת: כל span הוא שלב (או קובץ בודד, כשיש לו file) עם זמן, בתים, עמודים,
+    # הזיכרון של התהליך (הגבוה מבין תחילת ה-span וסופו) ושגיאה אם נזרקה. נאסף מכמה תהליכונים במקביל
+    def __init__(self, build_id=None):
+        self.build_id = build_id or uuid.uuid4().hex; self.started = time.time(); self.spans = []; self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        rec = {'stage': stage, **attrs}; start = time.perf_counter(); rss_start = rss_mb()
+        try: yield rec
+        except Exception as e: rec['error'] = f"{type(e).__name__}: {e}"; raise
+        finally:
+            rec['wall'] = round(time.perf_counter() - start, 4); rec['peak_rss_mb'] = max(rss_start, rss_mb())
+            with self._lock: self.spans.append(rec)
+
+    def wrap(self, stage, fn, **attrs):
+        # fn שכל קריאה שלו נמדדת כ-span, כולל גודל התוצאה
+        def run(*args, **kwargs):
+            with self.span(stage, **attrs) as rec:
+                res = fn(*args, **kwargs); rec['bytes'] = payload_bytes(res); return res
+        return run
+
+    def report(self, slowest=15):
+        # סיכום לפי שלב (זמן כולל, בתים, עמודים, שיא זיכרון, שגיאות) והקבצים האיטיים ביותר
+        with self._lock: spans = list(self.spans)
+        stages = {}
+        for s in spans:
+            row = stages.setdefault(s['stage'], {'stage': s['stage'], 'count': 0, 'wall': 0, 'bytes': 0, 'pages': 0, 'peak_rss_mb': 0, 'errors': 0})
+            row['count'] += 1; row['wall'] = round(row['wall'] + s['wall'], 3)
+            row['bytes'] += s.get('bytes', 0); row['pages'] += s.get('pages') or 0
+            row['peak_rss_mb'] = max(row['peak_rss_mb'], s['peak_rss_mb']); row['errors'] += 'error' in s
+        files = sorted((s for s in spans if 'file' in s), key=lambda s: -s['wall'])[:slowest]
+        peak = max([rss_mb(), *(s['peak_rss_mb'] for s in spans)])
+        return {'build': self.build_id, 'total': round(time.time() - self.started, 3), 'peak_rss_mb': peak,
+                'stages': list(stages.values()), 'slowest': files, 'errors': [s for s in spans if 'error' in s]}
+
+    def write(self, path, **meta):
+        # שורת JSON לכל span, כדי שאפשר יהיה להשוות בניות לאורך זמן
+        if not path: return
+        with self._lock: lines = [json.dumps({'build': self.build_id, 'started': self.started, **meta, **s}, ensure_ascii=False) for s in self.spans]
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f: f.write(''.join(l + '\n' for l in lines))
+        except OSError: pass
+
+@st.cache_resource
+def get_drive_credentials():
+    # מפתח חשבון השירות: gcp_key (תוכן ה-JSON, מ-secrets או ממשתנה הסביבה GCP_KEY), אחרת קובץ המפתח
+    # שב-gcp_key_file או ב-GOOGLE_APPLICATION_CREDENTIALS (להרצה משורת הפקודה)
+    key_content = get_setting('gcp_key', '')
+    if not key_content:
+        key_file = get_setting('gcp_key_file', os.environ.get('GOOGLE_APPLICATION_CREDENTIALS', ''))
+        if not key_file: raise RuntimeError("אין מפתח לדרייב (gcp_key, gcp_key_file או GOOGLE_APPLICATION_CREDENTIALS)")
+        with open(key_file, encoding='utf-8') as f: key_content = f.read()
+    creds_dict = json.loads(key_content, strict=False)
+    return service_account.Credentials.from_service_account_info(creds_dict, scopes=['https://www.googleapis.com/auth/drive'])
+
+@st.cache_resource
+def get_drive_clients():
+    # ההרשאות ומסמך ה-discovery נטענים פעם אחת לתהליך. httplib2 לא בטוח לשימוש מכמה תהליכונים,
+    # ולכן לכל תהליכון לקוח משלו, שנשמר אצלו יחד עם החיבורים הפתוחים
+    return threading.local()
+
+@st.cache_resource
+def get_drive_discovery():
+    return discovery_cache.get_static_doc('drive', 'v3')
+
+def get_drive_service():
+    # מפתח חסר או פגום נזרק כמו שהוא, כדי שהסיבה תגיע להודעה ול-trace
+    clients = get_drive_clients()
+    if getattr(clients, 'service', None) is None:
+        http = AuthorizedHttp(get_drive_credentials(), http=httplib2.Http(timeout=120))
+        clients.service = build_from_document(get_drive_discovery(), http=http)
+    return clients.service
+
+@st.cache_resource
+def get_drive_pool():
+    # מאגר תהליכונים אחד לכל הקריאות לדרייב בתהליך (הורדות, סריקת תיקיות). התהליכונים חיים לאורך זמן,
+    # ולכן הלקוח של כל אחד והחיבורים המאומתים שלו נשמרים בין בנייה לבנייה, לא רק בתוך קריאה אחת
+    return ThreadPoolExecutor(max_workers=max(1, get_setting('drive_workers', 4)), thread_name_prefix='binder-drive')
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+FILE_FIELDS = "id, name, mimeType, createdTime, modifiedTime, md5Checksum, headRevisionId, parents, trashed"
+
+def is_binder_mime(mime_type):
+    return mime_type in ('application/pdf', DOCX_MIME) or ('application/vnd.google-apps' in mime_type and mime_type != FOLDER_MIME)
+
+def list_children(folder_id):
+    # כל הילדים הישירים של תיקייה (קבצים ותיקיות משנה), על פני כל עמודי התוצאות
+    service = get_drive_service()
+    query = (f"'{folder_id}' in parents and trashed=false and "
+             f"(mimeType='application/pdf' or "
+             f"mimeType contains 'application/vnd.google-apps' or "
+             f"mimeType='{DOCX_MIME}')")
+    children = []; token = None
+    while True:
+        results = service.files().list(
+            q=query,
+            fields=f"nextPageToken, files({FILE_FIELDS})", 
+            orderBy="createdTime", 
+            pageSize=1000, pageToken=token,
+            supportsAllDrives=True, 
+            includeItemsFromAllDrives=True
+        ).execute()
+        children += results.get('files', []); token = results.get('nextPageToken')
+        if not token: return children
+
+def walk_folder(root_id, recursive):
+    # סריקה לפי רמות; תיקיות המשנה של כל רמה נסרקות במקביל
+    files = {}; folders = {root_id}; level = [root_id]; pool = get_drive_pool()
+    while level:
+        next_level = []
+        for children in pool.map(list_children, level):
+            for f in children:
+                if f['mimeType'] != FOLDER_MIME: files[f['id']] = f
+                elif recursive and f['id'] not in folders: folders.add(f['id']); next_level.append(f['id'])
+        level = next_level
+    return files, folders
+
+class FolderTreeChanged(Exception): pass
+
+class FolderListingCache:
+    # רשימות התיקיות נשמרות לכל (תיקייה, כולל תתי-תיקיות) למשך ttl שניות. אחרי זה הרענון עובר דרך
+    # פיד השינויים של דרייב (changes מ-startPageToken), כך שרק קבצים חדשים, ששונו או שנמחקו נשלפים.
+    # שינוי במבנה התיקיות עצמו, או token שפג תוקפו, מובילים לסריקה מלאה
+    def __init__(self, ttl):
+        self.ttl = ttl; self._entries = {}; self._lock = threading.Lock()
+
+    def list(self, folder_id, recursive=False):
+        key = (folder_id, recursive)
+        with self._lock: entry = self._entries.get(key)
+        if entry and time.time() - entry['at'] < self.ttl: return list(entry['files'].values())
+        if entry:
+            try: self._apply_changes(entry, folder_id, recursive); return list(entry['files'].values())
+            except (FolderTreeChanged, HttpError): pass
+        service = get_drive_service()
+        drive_id = service.files().get(fileId=folder_id, fields="driveId", supportsAllDrives=True).execute().get('driveId')
+        # ה-token נלקח לפני הסריקה, כדי ששינוי שקורה בזמן הסריקה לא יפוספס
+        token = service.changes().getStartPageToken(supportsAllDrives=True, **({'driveId': drive_id} if drive_id else {})).execute()['startPageToken']
+        files, folders = walk_folder(folder_id, recursive)
+        entry = {'files': files, 'folders': folders, 'token': token, 'drive_id': drive_id, 'at': time.time()}
+        with self._lock: self._entries[key] = entry
+        return list(files.values())
+
+    def _apply_changes(self, entry, folder_id, recursive):
+        service = get_drive_service(); token = entry['token']
+        files = dict(entry['files']); extra = {'driveId': entry['drive_id']} if entry['drive_id'] else {}
+        while token:
+            results = service.changes().list(
+                pageToken=token, pageSize=1000, spaces='drive',
+                fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))",
+                supportsAllDrives=True, includeItemsFromAllDrives=True, **extra).execute()
+            for change in results.get('changes', []):
+                f = change.get('file') or {}; file_id = change['fileId']
+                in_tree = not (change.get('removed') or f.get('trashed')) and any(p in entry['folders'] for p in f.get('parents', []))
+                if f.get('mimeType') == FOLDER_MIME:
+                    if file_id in entry['folders'] and file_id != folder_id and not in_tree: raise FolderTreeChanged()
+                    if recursive and in_tree and file_id not in entry['folders']: raise FolderTreeChanged()
+                elif in_tree and is_binder_mime(f.get('mimeType', '')): files[file_id] = f
+                else: files.pop(file_id, None)
+            token = results.get('nextPageToken')
+            if results.get('newStartPageToken'): entry['token'] = results['newStartPageToken']
+        entry['files'] = files; entry['at'] = time.time()
+
+@st.cache_resource
+def get_listing_cache():
+    return FolderListingCache(get_setting('listing_ttl', 60))
+
+def folder_id_from_link(folder_link):
+    match = re.search(r'folders/([a-zA-Z0-9-_]+)', folder_link)
+    return match.group(1) if match else (folder_link if len(folder_link)>20 else None)
+
+def list_files_from_drive(folder_link, recursive=False):
+    fid = folder_id_from_link(folder_link)
+    if not fid: return None, "קישור לא תקין"
+    try: get_drive_service()
+    except Exception as e: return None, f"שגיאת חיבור: {type(e).__name__}: {e}"
+    try: return fid, sorted(get_listing_cache().list(fid, recursive), key=lambda f: (f.get('createdTime', ''), f['name']))
+    except Exception as e: return None, str(e)
+
+def is_word_mime(mime_type):
+    # גוגל דוקס מיוצא ישירות ל-PDF, רק קבצי וורד עוברים המרה
+    return 'google-apps' not in mime_type and ('word' in mime_type or 'document' in mime_type)
+
+def binder_item(f):
+    # שורה בטבלת הקלסר עבור קובץ מרשימת התיקייה בדרייב
+    mime = f.get('mimeType', '')
+    if is_word_mime(mime): f_type = "WORD"
+    elif 'google-apps' in mime: f_type = "GDOC"
+    else: f_type = "PDF"
+    return {
+        "type": "file", "id": f['id'], "name": f['name'],
+        "title": "", "merge": False, "is_main": False,
+        "key": f['id'], "mime": mime, "ftype": f_type,
+        "modified": f.get('modifiedTime'), "md5": f.get('md5Checksum'), "revision": f.get('headRevisionId'),
+        "unique_id": str(uuid.uuid4())
+    }
+
+class SofficePool:
+    # מאגר מופעי libreoffice: לכל מופע תיקיית פרופיל קבועה משלו (נשמרת חמה בין הרצות),
+    # כך שהמרות במקביל לא מתנגשות על אותו פרופיל. כל קריאה ממירה אצווה של מסמכים בתהליך אחד.
+    def __init__(self, size, base_dir):
+        self.size = max(1, size); self._free = queue.Queue()
+        for i in range(self.size):
+            path = os.path.join(base_dir, f"profile_{i}"); os.makedirs(path, exist_ok=True)
+            self._free.put(Path(path).as_uri())
+
+    def convert_many(self, docs):
+        # תקלה בהרצה עצמה (אין libreoffice, חריגה מזמן) נזרקת; קובץ שלא הומר חוזר כ-None
+        if not docs: return []
+        profile = self._free.get()
+        try:
+            with TemporaryDirectory() as work:
+                paths = []
+                for n, data in enumerate(docs):
+                    p = os.path.join(work, f"doc_{n}.docx")
+                    with open(p, 'wb') as f: f.write(data)
+                    paths.append(p)
+                out_dir = os.path.join(work, 'out')
+                subprocess.run(['libreoffice', f'-env:UserInstallation={profile}', '--headless', '--norestore',
+                                '--convert-to', 'pdf', '--outdir', out_dir, *paths],
+                               timeout=60 + 30*len(docs), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                out = []
+                for n in range(len(docs)):
+                    p = os.path.join(out_dir, f"doc_{n}.pdf")
+                    if os.path.exists(p):
+                        with open(p, 'rb') as f: out.append(io.BytesIO(f.read()))
+                    else: out.append(None)
+                return out
+        finally: self._free.put(profile)
+
+@st.cache_resource
+def get_soffice_pool():
+    return SofficePool(get_setting('soffice_workers', 2), os.path.join(gettempdir(), 'binder_soffice'))
+
+def convert_word_to_pdf(input_bytes):
+    return get_soffice_pool().convert_many([input_bytes])[0]
+
+def download_file_content(file_id, mime_type, convert=True):
+    service = get_drive_service()
+    fh = io.BytesIO()
+    if 'vnd.google-apps' in mime_type:
+        request = service.files().export_media(fileId=file_id, mimeType='application/pdf')
+    else:
+        request = service.files().get_media(fileId=file_id)
+    
+    downloader = MediaIoBaseDownload(fh, request); done = False
+    while done is False: _, done = downloader.next_chunk()
+    fh.seek(0)
+    
+    if convert and is_word_mime(mime_type):
+        return convert_word_to_pdf(fh.getvalue())
+    return fh
+
+def open_mapped(path):
+    # קובץ PDF ממופה לזיכרון (קריאה בלבד). הדפים שייכים ל-page cache של מערכת ההפעלה
+    # ולא לזיכרון התהליך, והמיפוי נשאר תקף גם אם הקובץ נמחק אחר כך
+    with open(path, 'rb') as f: return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def spool_to_disk(fh, spool_dir):
+    data = fh.getvalue()
+    if not data: return None
+    with NamedTemporaryFile(dir=spool_dir, suffix='.pdf', delete=False) as f:
+        f.write(data); path = f.name
+    return open_mapped(path)
+
+class PdfCache:
+    # מטמון על הדיסק של קובצי ה-PDF הסופיים (אחרי הורדה/המרה), לפי מזהה וגרסה בדרייב.
+    # כל כניסה היא קובץ אחד; פינוי LRU לפי זמן שימוש אחרון כשהגודל הכולל עובר את המגבלה
+    def __init__(self, root, max_bytes):
+        self.root = root; self.max_bytes = max_bytes; self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key_for(item):
+        revision = [item.get('modified') or '', item.get('md5') or '', item.get('revision') or '']
+        if not any(revision): return None
+        return hashlib.sha256('|'.join([item['id'], *revision]).encode()).hexdigest()
+
+    def _path(self, key): return os.path.join(self.root, f"{key}.pdf")
+
+    def has(self, key): return os.path.exists(self._path(key))
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f: data = f.read()
+            os.utime(path)
+            return io.BytesIO(data)
+        except OSError: return None
+
+    def get_mapped(self, key):
+        # כמו get, אבל ממופה לזיכרון ישירות מקובץ המטמון במקום להיקרא ל-RAM
+        path = self._path(key)
+        try: mapped = open_mapped(path); os.utime(path); return mapped
+        except (OSError, ValueError): return None
+
+    def put(self, key, fh):
+        path = self._path(key); tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, 'wb') as f: f.write(fh.getvalue())
+            os.replace(tmp, path)
+        except OSError:
+            try: os.remove(tmp)
+            except OSError: pass
+            return
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.root):
+                if entry.name.endswith('.pdf'):
+                    try: info = entry.stat(); entries.append((info.st_mtime, info.st_size, entry.path))
+                    except OSError: pass
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes: break
+                try: os.remove(path); total -= size
+                except OSError: pass
+
+@st.cache_resource
+def get_pdf_cache():
+    root = get_setting('cache_dir', os.path.join(os.path.expanduser('~'), '.cache', 'binder_pdf'))
+    return PdfCache(root, get_setting('cache_max_mb', 2048) * 1024 * 1024)
+
+def read_layout(source):
+    # מספר העמודים והעמודים המסובבים. pypdf קורא רק את ה-xref ואת עץ העמודים (כולל /Rotate שעובר
+    # בירושה מהצמתים); זרמי התוכן לא מפוענחים
+    reader = source if isinstance(source, PdfReader) else PdfReader(source)
+    return {'pages': len(reader.pages), 'rotated': sum(1 for page in reader.pages if page.rotation % 360)}
+
+class LayoutCache:
+    # פריסה (read_layout) של כל גרסת קובץ, לפי PdfCache.key_for, בטבלת SQLite ליד מטמון ה-PDF.
+    # כל put כותב שורה אחת (לא את כל המטמון); מעבר ל-max_entries נזרקות הכניסות שנכתבו ראשונות
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path, max_entries=50000):
+        self.max_entries = max_entries; self._lock = threading.Lock(); self._puts = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # חיבור אחד לתהליך; WAL כדי שכמה תהליכים (עובדי שורת הפקודה) יכתבו בלי לחסום קוראים
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL"); self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS layouts (key TEXT PRIMARY KEY, layout TEXT, written REAL)")
+
+    def get(self, key):
+        if not key: return None
+        with self._lock: row = self._conn.execute("SELECT layout FROM layouts WHERE key=?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, layout):
+        if not key: return
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO layouts VALUES (?, ?, ?)", (key, json.dumps(layout), time.time()))
+            self._puts += 1
+            if self._puts % self.PRUNE_EVERY == 0:
+                self._conn.execute("DELETE FROM layouts WHERE key NOT IN (SELECT key FROM layouts ORDER BY written DESC LIMIT ?)", (self.max_entries,))
+
+@st.cache_resource
+def get_layout_cache():
+    return LayoutCache(os.path.join(get_pdf_cache().root, 'layout.sqlite'))
+
+def read_layouts(items):
+    # פריסה לכל קובץ בלי לגשת לדרייב: ממטמון הפריסה, אחרת מקובץ ה-PDF שכבר במטמון המקומי (ממופה לזיכרון).
+    # None לקובץ שצריך להוריד כדי לדעת
+    layouts = get_layout_cache(); pdfs = get_pdf_cache(); out = []
+    for f in items:
+        key = PdfCache.key_for(f); layout = layouts.get(key)
+        if layout is None and key:
+            mapped = pdfs.get_mapped(key)
+            if mapped is not None:
+                try: layout = read_layout(mapped); layouts.put(key, layout)
+                except Exception: layout = None
+        out.append(layout)
+    return out
+
+def fetch_binder_files(items, on_progress=None, spool_dir=None, on_item=None, trace=None):
+    # הורדה במקביל במאגר הדרייב המשותף; קבצי וורד נאספים לאצוות ומומרים במקביל במאגר ה-libreoffice
+    # תוך כדי שאר ההורדות. קבצים שהגרסה שלהם כבר במטמון לא נוגעים בדרייב כלל.
+    # התוצאות חוזרות באותו סדר של items (ו-on_item(אינדקס, תוצאה) נקרא לכל קובץ ברגע שהוא מוכן).
+    # עם spool_dir כל תוצאה נכתבת לדיסק ומוחזרת ממופה, כך שבזיכרון נמצאים רק הקבצים שבהורדה ברגע נתון.
+    # כל הורדה ואצוות המרה נמדדות ב-trace, כולל השגיאה אם נכשלו
+    trace = trace or BuildTrace()
+    batch_size = max(1, get_setting('soffice_batch', 8))
+    results = [None] * len(items); done = 0; pending_word = []
+    if not items: return results
+    cache = get_pdf_cache(); keys = [PdfCache.key_for(f) for f in items]
+    with trace.span('cache') as rec:
+        for i, key in enumerate(keys):
+            if key: results[i] = cache.get_mapped(key) if spool_dir else cache.get(key)
+        hits = [r for r in results if r is not None]; rec['hits'] = len(hits); rec['bytes'] = payload_bytes(hits)
+    for i, r in enumerate(results):
+        if r is not None:
+            done += 1
+            if on_progress: on_progress(done, len(items))
+            if on_item: on_item(i, r)
+    lo_pool = get_soffice_pool(); dl = get_drive_pool(); futs = {}
+    with ThreadPoolExecutor(max_workers=lo_pool.size) as conv:
+        try:
+            futs = {dl.submit(trace.wrap('download', download_file_content, file=f['name']), f['id'], f.get('mime', 'application/pdf'), False): ('dl', i)
+                    for i, f in enumerate(items) if results[i] is None}
+            while futs:
+                finished, _ = wait(futs, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    kind, idx = futs.pop(fut)
+                    try: res = fut.result()
+                    except Exception: res = None  # נרשם ב-span של ההורדה/ההמרה
+                    if kind == 'dl' and res is not None and is_word_mime(items[idx].get('mime', '')):
+                        pending_word.append((idx, res)); continue
+                    pairs = zip(idx, res or [None]*len(idx)) if kind == 'conv' else [(idx, res)]
+                    for i, r in pairs:
+                        if r is not None and keys[i]: cache.put(keys[i], r)
+                        if r is not None and spool_dir:
+                            r = (keys[i] and cache.get_mapped(keys[i])) or spool_to_disk(r, spool_dir)
+                        results[i] = r; done += 1
+                        if on_progress: on_progress(done, len(items))
+                        if on_item: on_item(i, r)
+                downloads_left = any(k == 'dl' for k, _ in futs.values())
+                while pending_word and (len(pending_word) >= batch_size or not downloads_left):
+                    batch, pending_word = pending_word[:batch_size], pending_word[batch_size:]
+                    convert = trace.wrap('convert', lo_pool.convert_many, file=', '.join(items[i]['name'] for i, _ in batch))
+                    futs[conv.submit(convert, [b.getvalue() for _, b in batch])] = ('conv', [i for i, _ in batch])
+        finally:
+            # הורדות שלא נאספו (למשל כשהבנייה בוטלה באמצע) לא ממשיכות לתפוס את המאגר המשותף
+            for fut in futs: fut.cancel()
+    return results
+
+class Prefetcher:
+    # הורדה, המרה וספירת עמודים ברקע מיד אחרי משיכת תיקייה, בזמן שהמשתמש עורך כותרות וסדר.
+    # התוצאות נכנסות למטמון ה-PDF (שם ההפקה תמצא אותן), והמצב של כל גרסת קובץ נשמר לתצוגת הטבלה
+    def __init__(self, chunk=20):
+        self.chunk = chunk; self._status = {}; self._lock = threading.Condition()
+
+    def status(self, item):
+        key = PdfCache.key_for(item)
+        return self._status.get(key) if key else None
+
+    def submit(self, items):
+        todo = []
+        with self._lock:
+            for f in items:
+                key = PdfCache.key_for(f)
+                if not key or self._status.get(key, {}).get('state') not in (None, 'error'): continue
+                # קובץ שהפריסה שלו כבר ידועה והוא במטמון המקומי מוכן מיד, בלי תהליכון
+                layout = get_layout_cache().get(key)
+                if layout and get_pdf_cache().has(key): self._status[key] = {'state': 'ready', **layout}
+                else: self._status[key] = {'state': 'pending'}; todo.append(f)
+        if todo: threading.Thread(target=self._run, args=(todo,), name='binder-prefetch', daemon=True).start()
+
+    def _run(self, items):
+        # במנות, כדי שבכל רגע רק מנה אחת של קבצים מוחזקת פתוחה
+        with TemporaryDirectory(prefix='binder_prefetch_') as spool_dir:
+            for start in range(0, len(items), self.chunk):
+                chunk = items[start:start+self.chunk]
+                def on_item(i, fh, chunk=chunk):
+                    key = PdfCache.key_for(chunk[i])
+                    try: layout = read_layout(fh) if fh is not None else None
+                    except Exception: layout = None
+                    if layout: get_layout_cache().put(key, layout)
+                    self._set(key, {'state': 'ready', **layout} if layout else {'state': 'error'})
+                try: fetch_binder_files(chunk, spool_dir=spool_dir, on_item=on_item)
+                except Exception: pass
+                for f in chunk:
+                    key = PdfCache.key_for(f)
+                    if self._status[key]['state'] == 'pending': self._set(key, {'state': 'error'})
+
+    def _set(self, key, status):
+        with self._lock: self._status[key] = status; self._lock.notify_all()
+
+    def wait(self, items, timeout=None):
+        # ממתין שקבצים שכבר בהכנה יסתיימו, כדי שההפקה לא תוריד אותם שוב במקביל
+        keys = [k for k in map(PdfCache.key_for, items) if k]
+        with self._lock:
+            return self._lock.wait_for(lambda: all(self._status.get(k, {}).get('state') != 'pending' for k in keys), timeout)
+
+@st.cache_resource
+def get_prefetcher():
+    return Prefetcher()
+
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+def drive_quote(value):
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
+def find_drive_file(service, folder_id, name):
+    q = f"name='{drive_quote(name)}' and '{folder_id}' in parents and trashed=false"
+    files = service.files().list(q=q, fields="files(id)", orderBy="modifiedTime desc", pageSize=1,
+                                 supportsAllDrives=True, includeItemsFromAllDrives=True).execute().get('files', [])
+    return files[0]['id'] if files else None
+
+def upload_final_pdf(folder_id, pdf, name, on_progress=None, update_existing=False):
+    # העלאה מתחדשת (resumable) במנות: pdf הוא נתיב לקובץ על הדיסק שמוזרם בלי לטעון אותו לזיכרון, או bytes.
+    # תקלה זמנית מנסה שוב את אותה מנה (עם המתנה גדלה) וממשיכה מהבייט האחרון שהתקבל.
+    # עם update_existing, אם כבר יש בתיקייה קובץ באותו שם מועלית אליו גרסה חדשה במקום קובץ כפול
+    service = get_drive_service()
+    chunk = max(1, get_setting('upload_chunk_mb', 8)) * 1024 * 1024
+    if isinstance(pdf, str): media = MediaFileUpload(pdf, mimetype='application/pdf', chunksize=chunk, resumable=True)
+    else: media = MediaIoBaseUpload(io.BytesIO(pdf), mimetype='application/pdf', chunksize=chunk, resumable=True)
+    existing = find_drive_file(service, folder_id, name) if update_existing else None
+    if existing: request = service.files().update(fileId=existing, media_body=media, supportsAllDrives=True)
+    else: request = service.files().create(body={'name': name, 'parents': [folder_id]}, media_body=media, supportsAllDrives=True)
+    retries = get_setting('upload_retries', 6); attempt = 0; response = None
+    while response is None:
+        try: status, response = request.next_chunk()
+        except (HttpError, OSError, httplib2.HttpLib2Error) as e:
+            if isinstance(e, HttpError) and e.resp.status not in RETRY_STATUSES: raise
+            attempt += 1
+            if attempt > retries: raise
+            time.sleep(min(60, 2 ** attempt) + random.random()); continue
+        attempt = 0
+        if status and on_progress: on_progress(status.progress())
+    if on_progress: on_progress(1.0)
+    return response['id']
+
+REVISION_FIELDS = "id, modifiedTime, md5Checksum, headRevisionId"
+
+def refresh_revisions(items):
+    # הגרסה הנוכחית בדרייב של כל קובץ, בבקשות batch של עד 100: השדות ב-items נקראו בזמן משיכת התיקייה,
+    # והקובץ יכול היה להשתנות מאז. מחזיר עותקים מעודכנים; קובץ שלא נקרא חוזר בלי גרסה, ולכן יורד מחדש
+    service = get_drive_service(); fresh = {}
+    def on_item(request_id, response, exception):
+        if exception is None: fresh[request_id] = response
+    ids = list(dict.fromkeys(f['id'] for f in items))
+    for start in range(0, len(ids), 100):
+        batch = service.new_batch_http_request(callback=on_item)
+        for file_id in ids[start:start+100]:
+            batch.add(service.files().get(fileId=file_id, fields=REVISION_FIELDS, supportsAllDrives=True), request_id=file_id)
+        batch.execute()
+    return [{**f, "modified": fresh.get(f['id'], {}).get('modifiedTime'), "md5": fresh.get(f['id'], {}).get('md5Checksum'),
+             "revision": fresh.get(f['id'], {}).get('headRevisionId')} for f in items]
+
+def rename_drive_files(renames):
+    # renames: רשימת (מזהה קובץ, שם חדש). נשלח בבקשות batch של עד 100 פריטים;
+    # מחזיר {מזהה קובץ: שגיאה} לכל פריט שנכשל
+    errors = {}
+    try: service = get_drive_service()
+    except Exception as e: return {file_id: f"שגיאת חיבור: {type(e).__name__}: {e}" for file_id, _ in renames}
+    def on_item(request_id, response, exception):
+        if exception is not None: errors[request_id] = str(exception)
+    pending = list(dict(renames).items())
+    for start in range(0, len(pending), 100):
+        chunk = pending[start:start+100]
+        batch = service.new_batch_http_request(callback=on_item)
+        for file_id, name in chunk:
+            batch.add(service.files().update(fileId=file_id, body={'name': name}, fields='id', supportsAllDrives=True), request_id=file_id)
+        try: batch.execute()
+        except Exception as e:
+            for file_id, _ in chunk: errors.setdefault(file_id, str(e))
+    return errors
+
+# ==========================================
+# 2. מנוע PDF
+# ==========================================
+FONT_PATHS = {
+    'BinderSans': ['/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', '/usr/share/fonts/truetype/noto/NotoSansHebrew-Regular.ttf'],
+    'BinderSans-Bold': ['/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf', '/usr/share/fonts/truetype/noto/NotoSansHebrew-Bold.ttf'],
+}
+_HEBREW = re.compile(r'[֐-׿יִ-ﭏ]')
+_MIRROR = str.maketrans('()[]{}<>', ')(][}{><')
+
+@st.cache_resource
+def get_fonts():
+    # רישום הגופנים פעם אחת לתהליך; בלי DejaVu/Noto נופלים ל-Helvetica (ללא עברית)
+    names = []
+    for name, paths in FONT_PATHS.items():
+        path = next((p for p in paths if os.path.exists(p)), None)
+        if path: pdfmetrics.registerFont(TTFont(name, path)); names.append(name)
+        else: names.append('Helvetica-Bold' if name.endswith('Bold') else 'Helvetica')
+    return tuple(names)
+
+def to_visual(text):
+    # סידור ויזואלי של שורה בכיוון RTL לציור משמאל לימין: קטעי עברית מתהפכים (כולל סוגריים),
+    # קטעי לטינית/מספרים נשארים בסדרם, ותווים ניטרליים בין שני קטעי LTR מצטרפים אליהם
+    kinds = ['R' if _HEBREW.match(ch) else 'L' if ch.isalnum() else 'N' for ch in text]
+    i = 0
+    while i < len(kinds):
+        if kinds[i] != 'N': i += 1; continue
+        j = i
+        while j < len(kinds) and kinds[j] == 'N': j += 1
+        between_ltr = i > 0 and kinds[i-1] == 'L' and j < len(kinds) and kinds[j] == 'L'
+        kinds[i:j] = ['L' if between_ltr else 'R'] * (j - i); i = j
+    segments = []
+    for ch, kind in zip(text, kinds):
+        if segments and segments[-1][0] == kind: segments[-1][1].append(ch)
+        else: segments.append((kind, [ch]))
+    return ''.join(''.join(chars) if kind == 'L' else ''.join(reversed(chars)).translate(_MIRROR)
+                   for kind, chars in reversed(segments))
+
+def wrap_text(text, font, size, width):
+    # שבירת שורות לפי מילים (בסדר הלוגי); מילה ארוכה מרוחב השורה נשארת שלמה
+    lines = []; line = ''
+    for word in str(text).split():
+        cand = f"{line} {word}" if line else word
+        if line and pdfmetrics.stringWidth(cand, font, size) > width: lines.append(line); line = word
+        else: line = cand
+    return lines + [line] if line or not lines else lines
+
+class CoverTemplate:
+    # תבנית שער לנספח: הגופנים והמיקומים מחושבים פעם אחת, ולכל שער מצוירים רק המספר, הכותרת והעמוד
+    def __init__(self, pagesize=A4):
+        self.pagesize = pagesize; self.width, self.height = pagesize
+        self.regular, self.bold = get_fonts()
+        self.margin = 25*mm
+        self.annex_y = self.height - 20*mm - 215
+        self.title_size, self.title_lead = 37, 46
+
+    def draw(self, can, annex_num, title, doc_start_page):
+        cx = self.width / 2
+        can.setFont(self.bold, 30); can.drawCentredString(cx, self.annex_y, to_visual(f"נספח {annex_num}"))
+        y = self.annex_y - 15
+        for line in wrap_text(title, self.bold, self.title_size, self.width - 2*self.margin):
+            y -= self.title_lead; can.setFont(self.bold, self.title_size); can.drawCentredString(cx, y, to_visual(line))
+        can.setFont(self.regular, 22); can.drawCentredString(cx, y - 67, to_visual(f"עמוד {doc_start_page}"))
+        can.showPage()
+
+def render_covers(covers):
+    # כל השערים במסמך אחד, עמוד לשער: covers היא רשימת (מספר נספח, כותרת, עמוד תחילת המסמך)
+    if not covers: return None
+    packet = io.BytesIO(); template = CoverTemplate()
+    can = canvas.Canvas(packet, pagesize=template.pagesize)
+    for annex_num, title, doc_start_page in covers: template.draw(can, annex_num, title, doc_start_page)
+    can.save(); return packet.getvalue()
+
+class TocLayout:
+    # פריסת טבלת תוכן העניינים: כותרת בעמוד הראשון, שורת כותרות טבלה שחוזרת בכל עמוד,
+    # ושורות שגובהן נקבע לפי מספר שורות הכותרת אחרי שבירה
+    HEADERS = ("סוג/מספר", "שם הנספח", "עמוד")
+    SHARES = (0.20, 0.65, 0.15)  # מימין לשמאל
+
+    def __init__(self, pagesize=A4):
+        self.pagesize = pagesize; self.width, self.height = pagesize
+        self.regular, self.bold = get_fonts()
+        self.left, self.right = 10*mm + 30, self.width - 10*mm - 30
+        self.top, self.bottom = self.height - 20*mm - 30, 10*mm + 30
+        self.font_size, self.head_size, self.pad, self.lead = 13.5, 15, 7.5, 17
+        table_w = self.right - self.left; x = self.right; self.cols = []
+        for share in self.SHARES: self.cols.append((x - share*table_w, x)); x -= share*table_w
+
+    def row_lines(self, row):
+        title_w = self.cols[1][1] - self.cols[1][0] - 2*self.pad
+        return wrap_text(row['title'], self.regular, self.font_size, title_w)
+
+    def paginate(self, rows):
+        # מחזיר רשימת עמודים; כל עמוד הוא רשימת (שורה, שורות טקסט, גובה)
+        head_h = self.head_size + 2*self.pad + 4
+        pages = [[]]; y = self.top - 60 - head_h
+        for row in rows:
+            lines = self.row_lines(row); h = len(lines)*self.lead + 2*self.pad
+            if y - h < self.bottom and pages[-1]: pages.append([]); y = self.top - head_h
+            pages[-1].append((row, lines, h)); y -= h
+        return pages
+
+    def link_rects(self, pages):
+        # (מספר עמוד ב-TOC, שורה, מלבן) לכל שורה, באותה גיאומטריה של draw_page, לקישור אל שער הנספח
+        out = []; head_h = self.head_size + 2*self.pad + 4
+        for n, page_rows in enumerate(pages):
+            y = self.top - (60 if n == 0 else 0) - head_h
+            for row, _, h in page_rows: out.append((n, row, (self.left, y - h, self.right, y))); y -= h
+        return out
+
+    def draw_page(self, can, page_rows, first):
+        y = self.top
+        if first:
+            can.setFont(self.bold, 34); can.drawCentredString(self.width/2, y - 34, to_visual("תוכן עניינים לנספחים")); y -= 60
+        top_y = y; head_h = self.head_size + 2*self.pad + 4
+        can.setFont(self.bold, self.head_size)
+        for (x0, x1), text in zip(self.cols, self.HEADERS): can.drawCentredString((x0+x1)/2, y - self.pad - self.head_size + 2, to_visual(text))
+        y -= head_h; can.setLineWidth(2); can.line(self.left, y, self.right, y)
+        can.setLineWidth(1)
+        for row, lines, h in page_rows:
+            (n0, n1), (t0, t1), (p0, p1) = self.cols
+            base = y - self.pad - self.font_size + 2
+            can.setFont(self.bold, self.font_size); can.drawCentredString((n0+n1)/2, base, to_visual(f"נספח {row['num']}"))
+            can.setFont(self.regular, self.font_size)
+            for k, line in enumerate(lines): can.drawRightString(t1 - self.pad, base - k*self.lead, to_visual(line))
+            can.drawCentredString((p0+p1)/2, base, str(row['page']))
+            y -= h; can.line(self.left, y, self.right, y)
+        for x0, _ in self.cols[:-1]: can.line(x0, top_y, x0, y)
+        can.setLineWidth(2); can.rect(self.left, y, self.right - self.left, top_y - y)
+        can.showPage()
+
+def render_toc(rows):
+    # תוכן העניינים כולו (כולל גלישה לכמה עמודים) במעבר אחד
+    layout = TocLayout(); packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=layout.pagesize)
+    for i, page_rows in enumerate(layout.paginate(rows)): layout.draw_page(can, page_rows, i == 0)
+    can.save(); return packet.getvalue()
+
+class PageNumberStamper:
+    # מספור עמודים בלי לבנות ולפענח PDF קטן לכל עמוד: גופן Helvetica אחד משותף לכל הקלסר,
+    # ולכל עמוד מתווסף רק זרם תוכן קצר. מטריצת המיקום נשמרת לכל (מסגרת העמוד, סיבוב)
+    FONT = NameObject('/FBinderNum')
+
+    def __init__(self, writer, size=12, margin=10*mm):
+        self.writer = writer; self.size = size; self.margin = margin; self._placements = {}
+        self.font_ref = self.save_ref = None  # נוצרים רק בחותמת הראשונה, כדי לא להשאיר אובייקטים יתומים
+
+    def _shared_objects(self):
+        if self.font_ref is None:
+            self.font_ref = self.writer._add_object(DictionaryObject({
+                NameObject('/Type'): NameObject('/Font'), NameObject('/Subtype'): NameObject('/Type1'),
+                NameObject('/BaseFont'): NameObject('/Helvetica'), NameObject('/Encoding'): NameObject('/WinAnsiEncoding')}))
+            self.save_ref = self._stream(b"q\n")  # עוטף את התוכן המקורי כדי שמצב הגרפיקה שלו לא ישפיע על המספר
+        return self.font_ref, self.save_ref
+
+    def _stream(self, data):
+        stream = DecodedStreamObject(); stream.set_data(data)
+        return self.writer._add_object(stream)
+
+    def _placement(self, page):
+        box = page.mediabox; rot = int(page.get('/Rotate', 0) or 0) % 360
+        key = (float(box.left), float(box.bottom), float(box.width), float(box.height), rot)
+        if key not in self._placements:
+            x0, y0, w, h, _ = key; m = self.margin
+            # נקודת העיגון היא אמצע השוליים התחתונים כפי שהעמוד מוצג אחרי הסיבוב
+            anchor = {0: (x0 + w/2, y0 + m), 90: (x0 + w - m, y0 + h/2),
+                      180: (x0 + w/2, y0 + h - m), 270: (x0 + m, y0 + h/2)}.get(rot, (x0 + w/2, y0 + m))
+            cos, sin = {90: (0, 1), 180: (-1, 0), 270: (0, -1)}.get(rot, (1, 0))
+            self._placements[key] = (anchor, cos, sin)
+        return self._placements[key]
+
+    def stamp(self, page, number):
+        font_ref, save_ref = self._shared_objects()
+        (ax, ay), cos, sin = self._placement(page); text = str(number)
+        half = pdfmetrics.stringWidth(text, 'Helvetica', self.size) / 2
+        tx, ty = ax - cos*half, ay - sin*half
+        res = page.get('/Resources')
+        if res is None: res = DictionaryObject(); page[NameObject('/Resources')] = res
+        res = res.get_object()
+        if '/Font' not in res: res[NameObject('/Font')] = DictionaryObject()
+        res['/Font'].get_object()[self.FONT] = font_ref
+        contents = page.get('/Contents'); body = []
+        if contents is not None:
+            obj = contents.get_object()
+            if isinstance(obj, ArrayObject): body = list(obj)
+            else: body = [contents if isinstance(contents, IndirectObject) else self.writer._add_object(obj)]
+        mark = (f"Q\nq BT {self.FONT} {self.size} Tf {cos} {sin} {-sin} {cos} {tx:.2f} {ty:.2f} Tm ({text}) Tj ET Q\n").encode()
+        page[NameObject('/Contents')] = ArrayObject([save_ref, *body, self._stream(mark)])
+
+def assemble_binder(sections, out_path=None, target_bytes=None, trace=None, outline=(), links=(), on_written=None):
+    # הרכבה במעבר אחד: sections היא רשימת (רצף עמודים, האם למספר) לפי הסדר הסופי. העמודים נלקחים ישירות
+    # מהקוראים של קובצי המקור, ממוספרים תוך כדי הוספה, והקלסר נכתב פעם אחת בסוף:
+    # ל-out_path אם ניתן (ואז מוחזר הנתיב), אחרת מוחזרים ה-bytes.
+    # אם הקלסר גדול מ-target_bytes, התמונות הגדולות נדחסות ברמה הקלה ביותר שמספיקה, והוא נכתב שוב;
+    # on_written(פלט) נקרא עם הכתיבה הראשונה, לפני הדחיסה (ל-BuildStore, שלא ישמור תמונות מוקטנות).
+    # outline: רשימת (כותרת, אינדקס עמוד) לסימניות; links: רשימת (אינדקס עמוד, מלבן, אינדקס יעד).
+    # עמודים עם קישורים מתווספים בלי ה-/Annots הקודמים שלהם (עמוד TOC מבנייה קודמת מצביע על עמודים שלה)
+    trace = trace or BuildTrace()
+    writer = PdfWriter(); stamper = PageNumberStamper(writer); number = 0; stamp_time = 0
+    linked = {page_index for page_index, _, _ in links}
+    with trace.span('assemble') as rec:
+        for pages, stamp in sections:
+            for page in pages:
+                added = writer.add_page(page, excluded_keys=('/Annots',) if number in linked else ()); number += 1
+                if stamp: t = time.perf_counter(); stamper.stamp(added, number); stamp_time += time.perf_counter() - t
+        for page_index, rect, target in links:
+            if max(page_index, target) < number:
+                # pypdf כותב target_page_index כמספר עמוד (תקף רק ליעד בקובץ אחר); קישור פנימי צריך הפניה לעמוד עצמו
+                annot = writer.add_annotation(page_index, Link(rect=rect, target_page_index=target))
+                annot[NameObject('/Dest')] = ArrayObject([writer.pages[target].indirect_reference, NameObject('/Fit')])
+        for title, page_index in outline:
+            if page_index < number: writer.add_outline_item(title, page_index)
+        if outline: writer.page_mode = '/UseOutlines'
+        rec['pages'] = number; rec['stamp_wall'] = round(stamp_time, 4)
+    # איחוד אובייקטים זהים (גופנים, תמונות) שחוזרים בין קובצי המקור
+    if hasattr(writer, 'compress_identical_objects'):
+        with trace.span('dedupe'): writer.compress_identical_objects()
+    with trace.span('write') as rec: out, size = write_pdf(writer, out_path); rec['bytes'] = size
+    if on_written: on_written(out)
+    if target_bytes and size > target_bytes:
+        with trace.span('compress', before=size): changed = compress_images(writer, size, target_bytes)
+        if changed:
+            with trace.span('write') as rec: out, size = write_pdf(writer, out_path); rec['bytes'] = size
+    return out
+
+def write_pdf(writer, out_path=None):
+    if out_path: writer.write(out_path); return out_path, os.path.getsize(out_path)
+    buf = io.BytesIO(); writer.write(buf); return buf.getvalue(), buf.tell()
+
+def linearize_pdf(pdf):
+    # "תצוגה מהירה" (linearized): qpdf מסדר מחדש את הקובץ כך שהעמוד הראשון מוצג לפני שכל הקלסר ירד.
+    # מקבל ומחזיר נתיב או bytes, כמו assemble_binder; None אם qpdf לא מותקן
+    qpdf = shutil.which('qpdf')
+    if not qpdf: return None
+    with TemporaryDirectory(prefix='binder_linear_') as work:
+        src = pdf
+        if not isinstance(pdf, str):
+            src = os.path.join(work, 'in.pdf')
+            with open(src, 'wb') as f: f.write(pdf)
+        dst = f"{pdf}.linear" if isinstance(pdf, str) else os.path.join(work, 'out.pdf')
+        # קוד 3 של qpdf = הצליח עם אזהרות
+        res = subprocess.run([qpdf, '--linearize', src, dst], capture_output=True, text=True, timeout=get_setting('linearize_timeout', 600))
+        if res.returncode not in (0, 3): raise RuntimeError(f"qpdf: {res.stderr.strip() or res.returncode}")
+        if isinstance(pdf, str): os.replace(dst, pdf); return pdf
+        with open(dst, 'rb') as f: return f.read()
+
+# ==========================================
+# דחיסת תמונות
+# ==========================================
+# (DPI מקסימלי, איכות JPEG), מהרמה הקלה לכבדה. רק תמונות רסטר גדולות שהרזולוציה שלהן ביחס לעמוד
+# עולה על ה-DPI של הרמה נדגמות מחדש; עמודי טקסט וקטורי לא נוגעים בהם
+COMPRESSION_LEVELS = [(200, 85), (150, 75), (110, 65), (80, 50)]
+MIN_IMAGE_BYTES = 100*1024
+
+def collect_images(writer):
+    # תמונות הרסטר הגדולות בקלסר, פעם אחת לכל אובייקט; תמונות עם תוכן זהה מקובצות יחד
+    # כדי שיידחסו פעם אחת. הרזולוציה האפקטיבית היא צלע התמונה הארוכה ביחס לצלע העמוד הארוכה
+    groups = {}; seen = set()
+    for page in writer.pages:
+        res = page.get('/Resources')
+        xobjects = res.get_object().get('/XObject') if res is not None else None
+        if xobjects is None: continue
+        page_inches = max(float(page.mediabox.width), float(page.mediabox.height)) / 72
+        for ref in xobjects.get_object().values():
+            if not isinstance(ref, IndirectObject) or ref.idnum in seen: continue
+            seen.add(ref.idnum); obj = ref.get_object()
+            if obj.get('/Subtype') != '/Image' or len(obj._data) < MIN_IMAGE_BYTES: continue
+            if any(k in obj for k in ('/SMask', '/Mask', '/ImageMask', '/Decode')): continue
+            dpi = max(int(obj.get('/Width', 0)), int(obj.get('/Height', 0))) / max(page_inches, 1)
+            group = groups.setdefault(hashlib.sha256(obj._data).hexdigest(), {'objects': [], 'dpi': 0, 'size': len(obj._data)})
+            group['objects'].append(obj); group['dpi'] = max(group['dpi'], dpi)
+    return list(groups.values())
+
+def decode_image(obj):
+    filters = obj.get('/Filter'); filters = list(filters) if isinstance(filters, ArrayObject) else [filters]
+    if filters == ['/DCTDecode']:
+        img = Image.open(io.BytesIO(obj._data))
+        return img if img.mode in ('L', 'RGB') else None
+    space = obj.get('/ColorSpace')
+    space = space.get_object() if space is not None else None
+    if isinstance(space, ArrayObject) and space[0] == '/ICCBased': space = {1: '/DeviceGray', 3: '/DeviceRGB'}.get(int(space[1].get_object().get('/N', 0)))
+    mode = {'/DeviceGray': 'L', '/DeviceRGB': 'RGB'}.get(space)
+    if mode is None or obj.get('/BitsPerComponent') != 8: return None
+    return Image.frombytes(mode, (int(obj['/Width']), int(obj['/Height'])), obj.get_data())
+
+def encode_image(img, size, dpi, max_dpi, quality):
+    # JPEG ברמה הנתונה: (JPEG, גודל, מצב צבע), או None אם התוצאה לא קטנה מ-size
+    scale = min(1.0, max_dpi / dpi)
+    if scale < 1: img = img.resize((max(1, round(img.width*scale)), max(1, round(img.height*scale))), Image.LANCZOS)
+    buf = io.BytesIO(); img.save(buf, 'JPEG', quality=quality, optimize=True)
+    return (buf.getvalue(), img.size, img.mode) if buf.tell() < size else None
+
+def recompress_image(obj, dpi, max_dpi, quality):
+    # None אם אי אפשר לפענח או שהתוצאה לא קטנה יותר
+    try:
+        img = decode_image(obj)
+        return encode_image(img, len(obj._data), dpi, max_dpi, quality) if img is not None else None
+    except Exception: return None
+
+SAMPLE_IMAGES = 4
+
+def compress_images(writer, size, target_bytes):
+    # בוחר את הרמה הקלה ביותר שצפויה להכניס את הקלסר מתחת ל-target_bytes (או את הכבדה ביותר) לפי מדגם:
+    # כמה תמונות מפוענחות פעם אחת ונדחסות בכל רמה, ויחס הדחיסה שלהן מוחל על כל התמונות של הרמה.
+    # רק אז כל התמונות נדחסות במקביל, ברמה שנבחרה (ובכבדה ממנה אם ההערכה לא הספיקה), ומוחלפות במקום.
+    # מחזיר True אם משהו השתנה
+    groups = collect_images(writer)
+    if not groups: return False
+    pool = get_image_pool(); decoded = {}; encoded = {}  # encoded: (תמונה, רמה) -> תוצאה, כדי שהמדגם לא יידחס פעמיים
+
+    def sample_size(g, level):
+        max_dpi, quality = COMPRESSION_LEVELS[level]
+        try:
+            if id(g) not in decoded: decoded[id(g)] = decode_image(g['objects'][0])
+            img = decoded[id(g)]
+            res = encode_image(img, g['size'], g['dpi'], max_dpi, quality) if img is not None else None
+        except Exception: res = None
+        encoded[(id(g), level)] = res
+        return len(res[0]) if res else g['size']
+
+    first = len(COMPRESSION_LEVELS) - 1
+    for level, (max_dpi, _) in enumerate(COMPRESSION_LEVELS[:-1]):
+        todo = sorted((g for g in groups if g['dpi'] > max_dpi), key=lambda g: g['size'])
+        if not todo: continue
+        sample = todo[::max(1, len(todo) // SAMPLE_IMAGES)][:SAMPLE_IMAGES]
+        ratio = sum(pool.map(lambda g: sample_size(g, level), sample)) / sum(g['size'] for g in sample)
+        if size - sum(g['size'] for g in todo) * (1 - ratio) <= target_bytes: first = level; break
+    decoded.clear(); chosen = {}
+    for level in range(first, len(COMPRESSION_LEVELS)):
+        max_dpi, quality = COMPRESSION_LEVELS[level]
+        todo = [g for g in groups if g['dpi'] > max_dpi]
+        results = pool.map(lambda g: encoded[(id(g), level)] if (id(g), level) in encoded
+                           else recompress_image(g['objects'][0], g['dpi'], max_dpi, quality), todo)
+        chosen = {id(g): r for g, r in zip(todo, results) if r}
+        if size - sum(g['size'] - len(chosen[id(g)][0]) for g in todo if id(g) in chosen) <= target_bytes: break
+    for g in groups:
+        if id(g) not in chosen: continue
+        data, (w, h), mode = chosen[id(g)]
+        for obj in g['objects']:
+            obj.clear()
+            obj.update({NameObject('/Type'): NameObject('/XObject'), NameObject('/Subtype'): NameObject('/Image'),
+                        NameObject('/Width'): NumberObject(w), NameObject('/Height'): NumberObject(h),
+                        NameObject('/ColorSpace'): NameObject('/DeviceRGB' if mode == 'RGB' else '/DeviceGray'),
+                        NameObject('/BitsPerComponent'): NumberObject(8), NameObject('/Filter'): NameObject('/DCTDecode')})
+            obj._data = data
+            if hasattr(obj, 'decoded_self'): obj.decoded_self = None
+    return bool(chosen)
+
+@st.cache_resource
+def get_image_pool():
+    # מאגר משותף לכל הבניות בתהליך, כך שמספר הדחיסות במקביל מוגבל גלובלית
+    return ThreadPoolExecutor(max_workers=max(1, get_setting('compress_workers', os.cpu_count() or 2)), thread_name_prefix='binder-img')
+
+# ==========================================
+# 3. בניית קלסר
+# ==========================================
+def split_blocks(files):
+    # בלוק = ראשי, או נספח יחד עם הקבצים הממוזגים אליו
+    blocks = []; current_block = []
+    for item in files:
+        is_main = item.get('is_main', False)
+        is_merged = item.get('merge', False)
+        start_new = is_main or (not is_merged)
+        if start_new:
+            if current_block: blocks.append(current_block)
+            current_block = [item]
+        else: current_block.append(item)
+    if current_block: blocks.append(current_block)
+    return blocks
+
+def signature(*parts):
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode()).hexdigest()
+
+class BuildStore:
+    # הבנייה הקודמת של כל קלסר (תיקייה + שם קובץ): manifest.json ופלט הקלסר לפני דחיסה.
+    # ה-manifest שומר את חלוקת הקלסר לקטעים, כל קטע עם חתימה של כל מה שקובע את תוכנו
+    # (קבצי מקור, גרסאותיהם ומספר העמודים של כל אחד, כותרת, מספרי עמודים), ואת מספר העמודים של כל גרסת קובץ.
+    # הפלט נכתב לקובץ בשם ייחודי שרשום ב-manifest, וה-manifest מוחלף אחרון: כתיבה שנכשלה באמצע
+    # או שתי בניות של אותו קלסר במקביל לא יכולות לזווג manifest עם פלט של בנייה אחרת
+    def __init__(self, root, folder_id, name):
+        self.dir = os.path.join(root, signature(folder_id, name)[:32])
+        self.manifest_path = os.path.join(self.dir, 'manifest.json')
+
+    def _read_manifest(self):
+        with open(self.manifest_path, encoding='utf-8') as f: return json.load(f)
+
+    def load(self):
+        # בנייה מלאה ({}, None) אם אין בנייה קודמת, או שהפלט לא תואם את הקטעים שב-manifest
+        try:
+            manifest = self._read_manifest()
+            prev = PdfReader(open_mapped(os.path.join(self.dir, manifest['output'])))
+            if len(prev.pages) != sum(seg['count'] for seg in manifest['segments']): return {}, None
+            return manifest, prev
+        except Exception: return {}, None
+
+    def save(self, manifest, output):
+        os.makedirs(self.dir, exist_ok=True)
+        try: old = self._read_manifest().get('output')
+        except (OSError, ValueError): old = None
+        name = f"binder-{uuid.uuid4().hex}.pdf"; path = os.path.join(self.dir, name); tmp = f"{self.manifest_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            if isinstance(output, str): shutil.copyfile(output, path)
+            else:
+                with open(path, 'wb') as f: f.write(output)
+            with open(tmp, 'w', encoding='utf-8') as f: json.dump({**manifest, 'output': name}, f, ensure_ascii=False)
+            os.replace(tmp, self.manifest_path)
+        except OSError:
+            for leftover in (path, tmp):
+                try: os.remove(leftover)
+                except OSError: pass
+            raise
+        # הפלט הקודם נמחק רק אחרי שה-manifest כבר מצביע על החדש (מי שכבר פתח אותו ממשיך עם המיפוי)
+        if old and old != name:
+            try: os.remove(os.path.join(self.dir, old))
+            except OSError: pass
+
+def get_build_store(folder_id, name):
+    if not get_setting('incremental_builds', True): return None
+    return BuildStore(get_setting('builds_dir', os.path.join(os.path.expanduser('~'), '.cache', 'binder_builds')), folder_id, name)
+
+def build_binder(files, folder_id, out_name, rename_source=False, spool_dir=None, target_mb=None, linearize=False,
+                 on_status=None, on_progress=None, on_warning=None, trace=None):
+    # בונה את הקלסר ומחזיר bytes (או נתיב, כשיש spool_dir). כשקיימת בנייה קודמת, קטעים
+    # שהחתימה שלהם לא השתנתה (ראשי, תוכן עניינים, שער, נספח) מועתקים ממנה כמו שהם, כולל
+    # מספרי העמודים, וקבצי המקור שלהם לא נפתחים בכלל. כל שלב נמדד ב-trace
+    trace = trace or BuildTrace()
+    on_status = on_status or (lambda msg: None); on_progress = on_progress or (lambda frac: None)
+    on_warning = on_warning or (lambda msg: None)
+    on_status("📥 מוריד ומעבד...")
+    # הגרסאות נקראות מחדש לפני שמפתחות המטמון והפריסה נגזרים מהן: קובץ שנערך בדרייב מאז משיכת
+    # התיקייה (או מאז שהעבודה נכנסה לתור) יורד מחדש
+    with trace.span('revisions', files=len(files)): files = refresh_revisions(files)
+    blocks = split_blocks(files)
+    all_items = [f for block in blocks for f in block]
+    store = get_build_store(folder_id, out_name)
+    manifest, prev = store.load() if store else ({}, None)
+    known_counts = manifest.get('page_counts', {})
+    revs = [PdfCache.key_for(f) for f in all_items]
+    count_keys = [f"{f['id']}:{rev}" if rev else None for f, rev in zip(all_items, revs)]
+    counts = [known_counts.get(k) if k else None for k in count_keys]
+    readers = [None] * len(all_items)
+    # 0. מעבר פריסה: מספרי העמודים של קבצים שלא היו בבנייה הקודמת, ממטמון הפריסה לפי גרסה,
+    # כך שרק קבצים שבאמת צריך לבנות מחדש יורדו וייפתחו
+    unknown = [i for i, c in enumerate(counts) if c is None]
+    with trace.span('layout', files=len(unknown)) as rec:
+        for i, layout in zip(unknown, read_layouts([all_items[i] for i in unknown])):
+            if layout: counts[i] = layout['pages']
+        rec['hits'] = sum(counts[i] is not None for i in unknown)
+
+    def load_sources(indices, lo, hi):
+        if not indices: return
+        items = [all_items[i] for i in indices]
+        with trace.span('fetch', files=len(items)) as rec:
+            fetched = fetch_binder_files(items, on_progress=lambda d, t: on_progress(lo + (hi-lo)*d/t), spool_dir=spool_dir, trace=trace)
+            rec['bytes'] = payload_bytes(fetched)
+        for i, fh in zip(indices, fetched):
+            f = all_items[i]
+            if not fh: on_warning(f"הורדה נכשלה: {f['name']}"); counts[i] = None; continue
+            try:
+                with trace.span('parse', file=f['name'], bytes=payload_bytes(fh)) as rec:
+                    readers[i] = PdfReader(fh); layout = read_layout(readers[i]); counts[i] = rec['pages'] = layout['pages']
+                get_layout_cache().put(revs[i], layout)
+            except Exception as e: on_warning(f"קובץ פגום: {f['name']} ({e})"); counts[i] = None
+
+    # --- עיבוד ---
+    # 1. קבצים שמספר העמודים שלהם עדיין לא ידוע (חדשים או שהשתנו) נטענים מיד
+    load_sources([i for i, c in enumerate(counts) if c is None], 0, 0.4)
+
+    reusable = {s['sig']: s for s in manifest.get('segments', [])} if prev else {}
+    def plan():
+        # פריסת הקלסר מתוך מספרי העמודים בלבד, בלי לפתוח אף קובץ: בלוקים, תוכן עניינים וקטעים
+        processed_blocks = []
+        real_annex_counter = 0; pos = 0
+        for block in blocks:
+            head = block[0]
+            is_main = head.get('is_main', False)
+            if not is_main: real_annex_counter += 1
+            indices = list(range(pos, pos + len(block))); pos += len(block)
+            processed_blocks.append({
+                "is_main": is_main,
+                "annex_num": real_annex_counter if not is_main else None,
+                "title": head['title'].strip(),
+                "items": indices,
+                "revisions": [count_keys[i] or all_items[i]['id'] for i in indices],
+                "counts": [counts[i] for i in indices],
+                "page_count": sum(counts[i] or 0 for i in indices)
+            })
+
+        # --- הרכבה ו-TOC ---
+        # 1. חישוב מיקום התחלה של TOC (אחרי כל הראשיים)
+        main_pages_count = sum(b['page_count'] for b in processed_blocks if b['is_main'])
+
+        def toc_rows(toc_length):
+            # נספח 1 מתחיל ב: סך עמודי ראשיים + עמודי TOC + 1 (כי יש שער לנספח 1)
+            rows = []; running_page_after_toc = main_pages_count + toc_length + 1
+            for blk in processed_blocks:
+                if blk['is_main']: continue
+                # בתוכן עניינים מציינים את עמוד השער; מקדמים את המונה: שער (1) + דפי המסמך
+                rows.append({"num": blk['annex_num'], "title": blk['title'], "page": running_page_after_toc})
+                running_page_after_toc += 1 + blk['page_count']
+            return rows
+
+        # 2. אורך ה-TOC תלוי במספרי העמודים שבו ולהפך: פורסים (בלי לצייר) עד שהאורך מתייצב,
+        # ורק אז מציירים פעם אחת עם מספרי העמודים הסופיים
+        toc_length = 1
+        while True:
+            toc_data = toc_rows(toc_length); toc_pages_needed = len(TocLayout().paginate(toc_data))
+            if toc_pages_needed <= toc_length: break
+            toc_length = toc_pages_needed
+
+        # --- חלוקה לקטעים ---
+        # סדר: ראשיים, תוכן עניינים, ולכל נספח שער ואחריו עמודי המסמך. page הוא מספר העמוד
+        # הראשון של הקטע בקלסר, ולכן הוא חלק מהחתימה: קטע שזז נבנה מחדש וממוספר מחדש
+        segments = []; page = 1
+        def add_segment(kind, count, *key, **extra):
+            nonlocal page
+            segments.append(dict(kind=kind, count=count, sig=signature(kind, page, *key), first_page=page, **extra)); page += count
+        for blk in processed_blocks:
+            if blk['is_main']: add_segment('main', blk['page_count'], blk['revisions'], blk['counts'], block=blk)
+        add_segment('toc', toc_length, toc_data)
+        for blk in processed_blocks:
+            if blk['is_main']: continue
+            add_segment('cover', 1, blk['annex_num'], blk['title'], page + 1, block=blk)
+            add_segment('body', blk['page_count'], blk['revisions'], blk['counts'], block=blk)
+
+        # קטע נלקח מהבנייה הקודמת רק אם יצאו בה בדיוק העמודים המתוכננים (קובץ שלא ירד אז יצא ריק)
+        reused = [s['sig'] in reusable and reusable[s['sig']]['count'] == s['count'] for s in segments]
+        return processed_blocks, toc_data, segments, reused
+
+    on_status("📑 בונה תוכן עניינים...")
+    # 2. קבצי מקור של קטעים שלא ניתן לשחזר ושעוד לא נטענו. מספר עמודים מהמטמון שלא התאמת בטעינה
+    # (הורדה נכשלה, קובץ פגום) משנה את הפריסה, ולכן מתכננים שוב עד שהיא יציבה; כך תוכן העניינים
+    # והשערים מצוירים פעם אחת, עם המספרים הסופיים
+    while True:
+        processed_blocks, toc_data, segments, reused = plan()
+        missing = sorted({i for s, r in zip(segments, reused) if not r and s['kind'] in ('main', 'body')
+                          for i in s['block']['items'] if readers[i] is None and counts[i] is not None})
+        expected = [counts[i] for i in missing]
+        load_sources(missing, 0.4, 0.8)
+        if [counts[i] for i in missing] == expected: break
+
+    if rename_source:
+        renames = []; names = {}
+        for blk, block in zip(processed_blocks, blocks):
+            if blk['is_main']: continue
+            sub_count = 0
+            for i, f in zip(blk['items'], block):
+                if counts[i] is None: continue
+                sub_count += 1
+                ext = Path(f['name']).suffix
+                base = f"נספח {blk['annex_num']} - {blk['title']}"
+                new_n = f"{base} ({sub_count}){ext}" if len(block)>1 else f"{base}{ext}"
+                if f['name'] != new_n: renames.append((f['id'], new_n)); names[f['id']] = f['name']
+        with trace.span('rename', files=len(renames)): errors = rename_drive_files(renames)
+        for file_id, err in errors.items(): on_warning(f"שינוי שם נכשל: {names[file_id]} ({err})")
+
+    # --- איחוד פיזי ---
+    toc_pages = []
+    if not all(r for s, r in zip(segments, reused) if s['kind'] == 'toc'):
+        with trace.span('toc', rows=len(toc_data)) as rec:
+            toc_bytes = render_toc(toc_data)
+            toc_pages = PdfReader(io.BytesIO(toc_bytes)).pages if toc_bytes else []
+            rec['bytes'] = payload_bytes(toc_bytes); rec['pages'] = len(toc_pages)
+    # כל השערים שצריך לצייר מחדש מצוירים במסמך אחד (שער = עמוד אחד)
+    new_covers = [s for s, r in zip(segments, reused) if s['kind'] == 'cover' and not r]
+    with trace.span('covers', pages=len(new_covers)) as rec:
+        covers_bytes = render_covers([(s['block']['annex_num'], s['block']['title'], s['first_page'] + 1) for s in new_covers])
+        cover_pages = dict(zip(map(id, new_covers), PdfReader(io.BytesIO(covers_bytes)).pages)) if covers_bytes else {}
+        rec['bytes'] = payload_bytes(covers_bytes)
+
+    # סימניות: כל מסמך ראשי, תוכן העניינים וכל שער נספח. שורות ה-TOC מקושרות לשער של הנספח שלהן
+    sections = []; out_segments = []; start = 0; outline = []; covers = {}; toc_start = None
+    for s, r in zip(segments, reused):
+        if r:
+            old = reusable[s['sig']]
+            pages = [prev.pages[k] for k in range(old['start'], old['start'] + old['count'])]
+        elif s['kind'] == 'toc': pages = list(toc_pages)
+        elif s['kind'] == 'cover': pages = [cover_pages[id(s)]] if id(s) in cover_pages else []
+        else: pages = [p for i in s['block']['items'] if readers[i] for p in readers[i].pages]
+        sections.append((pages, not r))
+        blk = s.get('block')
+        if pages and s['kind'] == 'main': outline.append((blk['title'] or all_items[blk['items'][0]]['name'], start))
+        elif pages and s['kind'] == 'toc': outline.append(("תוכן עניינים", start)); toc_start = start
+        elif pages and s['kind'] == 'cover':
+            outline.append((f"נספח {blk['annex_num']}" + (f" - {blk['title']}" if blk['title'] else ""), start)); covers[blk['annex_num']] = start
+        out_segments.append({"kind": s['kind'], "sig": s['sig'], "start": start, "count": len(pages)}); start += len(pages)
+    on_status(f"🔢 מסיים... (♻️ {sum(reused)}/{len(segments)} חלקים מהבנייה הקודמת)" if prev else "🔢 מסיים...")
+    target_bytes = int(target_mb * 1024 * 1024) if target_mb else None
+    links = []
+    if toc_start is not None:
+        layout = TocLayout()
+        links = [(toc_start + n, rect, covers[row['num']]) for n, row, rect in layout.link_rects(layout.paginate(toc_data)) if row['num'] in covers]
+    def save_build(out):
+        # הבנייה נשמרת לפני דחיסה ותצוגה מהירה, כך שקטעים שיילקחו ממנה לא יישאו תמונות מוקטנות
+        # לבנייה עם יעד גודל אחר (או בלי יעד)
+        if not store: return
+        try:
+            store.save({"layout": [{k: b[k] for k in ('is_main', 'annex_num', 'title', 'revisions', 'page_count')} for b in processed_blocks],
+                        "page_counts": {k: c for k, c in zip(count_keys, counts) if k and c is not None},
+                        "segments": out_segments}, out)
+        except OSError: pass
+    out = assemble_binder(sections, os.path.join(spool_dir, 'binder.pdf') if spool_dir else None, target_bytes, trace=trace,
+                          outline=outline, links=links, on_written=save_build)
+    if linearize:
+        with trace.span('linearize') as rec:
+            linear = linearize_pdf(out)
+            if linear is None: on_warning("qpdf לא מותקן: הקלסר נשמר בלי תצוגה מהירה"); rec['skipped'] = True
+            else: out = linear; rec['bytes'] = payload_bytes(out)
+    return out
+
+# ==========================================
+# 4. תור בנייה ברקע
+# ==========================================
+class JobCancelled(Exception): pass
+
+class JobQueue:
+    # בניית קלסרים ברקע: טבלת עבודות ב-SQLite ששורדת הפעלה מחדש, ומאגר תהליכונים משותף לכל
+    # המשתמשים. הממשק רק שולח עבודה ומציג את השלב וההתקדמות שנשמרים בטבלה
+    ACTIVE = ('queued', 'running')
+
+    def __init__(self, db_path, workers, out_dir, trace_log=None):
+        self.db_path = db_path; self.out_dir = out_dir; self.trace_log = trace_log; self._lock = threading.Lock(); self._cancelled = set()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True); os.makedirs(out_dir, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='binder-job')
+        self._execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, created REAL, updated REAL, status TEXT, stage TEXT, progress REAL,
+            params TEXT, warnings TEXT DEFAULT '[]', output TEXT, report TEXT)""")
+        if 'report' not in {row['name'] for row in self._execute("PRAGMA table_info(jobs)")}:
+            self._execute("ALTER TABLE jobs ADD COLUMN report TEXT")
+        # עבודות שנקטעו בהפעלה הקודמת חוזרות לתור; המטמון והבנייה המצטברת חוסכים את מה שכבר נעשה
+        self._execute("UPDATE jobs SET status='queued' WHERE status='running'")
+        for row in self._execute("SELECT id FROM jobs WHERE status='queued' ORDER BY created"):
+            self._pool.submit(self._run, row['id'])
+
+    def _execute(self, sql, args=()):
+        with self._lock, closing(sqlite3.connect(self.db_path, timeout=30)) as conn, conn:
+            conn.row_factory = sqlite3.Row
+            return conn.execute(sql, args).fetchall()
+
+    def _update(self, job_id, **fields):
+        cols = ', '.join(f"{k}=?" for k in fields)
+        self._execute(f"UPDATE jobs SET {cols}, updated=? WHERE id=?", (*fields.values(), time.time(), job_id))
+
+    def submit(self, params):
+        job_id = uuid.uuid4().hex; now = time.time()
+        self._execute("INSERT INTO jobs (id, created, updated, status, stage, progress, params) VALUES (?, ?, ?, 'queued', '', 0, ?)",
+                      (job_id, now, now, json.dumps(params, ensure_ascii=False)))
+        self._pool.submit(self._run, job_id)
+        return job_id
+
+    def get(self, job_id):
+        rows = self._execute("SELECT * FROM jobs WHERE id=?", (job_id,))
+        if not rows: return None
+        job = dict(rows[0]); job['warnings'] = json.loads(job['warnings'] or '[]')
+        job['report'] = json.loads(job['report']) if job['report'] else None
+        return job
+
+    def cancel(self, job_id):
+        self._cancelled.add(job_id)
+        self._execute("UPDATE jobs SET status='cancelled', stage='⛔ בוטל', updated=? WHERE id=? AND status='queued'", (time.time(), job_id))
+
+    def _run(self, job_id):
+        job = self.get(job_id)
+        if not job or job['status'] != 'queued': self._cancelled.discard(job_id); return
+        self._update(job_id, status='running', stage='📥 מוריד ומעבד...', progress=0)
+        params = json.loads(job['params']); warnings = []; trace = BuildTrace(job_id)
+
+        def check():
+            if job_id in self._cancelled: raise JobCancelled()
+        def on_status(msg): check(); self._update(job_id, stage=msg)
+        def on_progress(frac): check(); self._update(job_id, progress=frac)
+        def on_warning(msg): warnings.append(msg); self._update(job_id, warnings=json.dumps(warnings, ensure_ascii=False))
+
+        # low_memory הוא השם הקודם של האפשרות, בעבודות שנכנסו לתור לפני השינוי
+        spool_to_disk = params.get('spool_to_disk', params.get('low_memory'))
+        spool = TemporaryDirectory(prefix='binder_', dir=get_setting('spool_dir', gettempdir())) if spool_to_disk else None
+        try:
+            on_status("⏳ ממתין לקבצים שבהכנה ברקע...")
+            # בפרוסות קצרות, כדי שביטול בזמן ההמתנה ייתפס מיד
+            with trace.span('prefetch_wait'):
+                deadline = time.time() + get_setting('prefetch_wait', 600)
+                while not get_prefetcher().wait(params['files'], timeout=min(1, max(0, deadline - time.time()))) and time.time() < deadline: check()
+            res = build_binder(params['files'], params['folder_id'], params['name'],
+                               rename_source=params.get('rename_source', False), spool_dir=spool.name if spool else None,
+                               target_mb=params.get('target_mb'), linearize=params.get('linearize', False),
+                               on_status=on_status, on_progress=on_progress, on_warning=on_warning, trace=trace)
+            on_status("☁️ מעלה...")
+            try:
+                with trace.span('upload', bytes=payload_bytes(res)):
+                    upload_final_pdf(params['folder_id'], res, f"{params['name']}.pdf", update_existing=params.get('update_existing', False),
+                                     on_progress=lambda frac: on_progress(0.8 + 0.2*frac))
+                self._update(job_id, status='done', stage='✅ בוצע!', progress=1)
+            except JobCancelled: raise
+            except Exception as e:
+                # הקובץ נשמר כדי שאפשר יהיה להוריד אותו ידנית, גם אחרי רענון הדפדפן
+                out = os.path.join(self.out_dir, f"{job_id}.pdf")
+                if isinstance(res, str): shutil.copyfile(res, out)
+                else:
+                    with open(out, 'wb') as f: f.write(res)
+                self._update(job_id, status='done', stage=f"העלאה נכשלה ({e}). הורד ידנית:", progress=1, output=out)
+        except JobCancelled: self._update(job_id, status='cancelled', stage='⛔ בוטל')
+        except Exception as e: self._update(job_id, status='failed', stage=f"שגיאה: {e}")
+        finally:
+            self._cancelled.discard(job_id)
+            if spool: spool.cleanup()
+            self._update(job_id, report=json.dumps(trace.report(), ensure_ascii=False))
+            trace.write(self.trace_log, job=job_id, name=params['name'], files=len(params['files']))
+
+@st.cache_resource
+def get_job_queue():
+    root = get_setting('jobs_dir', os.path.join(os.path.expanduser('~'), '.cache', 'binder_jobs'))
+    return JobQueue(os.path.join(root, 'jobs.sqlite'), get_setting('build_workers', 2), os.path.join(root, 'output'),
+                    get_setting('trace_log', os.path.join(root, 'trace.jsonl')))